@@ -0,0 +1,56 @@
+# Microbenchmark: JSON serialization time per 1k rows, before and after the orjson response class.
+# Run from the repository root: python -m src.api.bench_serialization
+
+import timeit
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+from .main import ORJSONResponse
+
+ROWS = 1000
+REPEAT = 20
+
+
+def make_detection_rows(n=ROWS):
+    """Rows shaped like `/image_detections` results, with the datetime and NUMERIC types psycopg2 returns."""
+    start = datetime(2025, 1, 1, tzinfo=timezone.utc)
+    return [
+        {
+            "image_detection_id": i,
+            "message_id": 100000 + i,
+            "detected_message_date": start + timedelta(minutes=i),
+            "channel_username": "lobelia4cosmetics",
+            "image_path": f"/app/data/raw/telegram_media/lobelia4cosmetics/photo_{i}.jpg",
+            "detected_object_class": "bottle",
+            "confidence_score": Decimal("0.873412"),
+            "box_xmin": Decimal("12.5"),
+            "box_ymin": Decimal("40.25"),
+            "box_xmax": Decimal("220.0"),
+            "box_ymax": Decimal("310.75"),
+            "detection_timestamp": start + timedelta(minutes=i, seconds=30),
+        }
+        for i in range(n)
+    ]
+
+
+def before(rows):
+    """Untyped dicts through jsonable_encoder and the standard JSONResponse."""
+    return JSONResponse(jsonable_encoder(rows)).body
+
+
+def after(rows):
+    """Rows rendered directly by the orjson-backed response class."""
+    return ORJSONResponse(rows).body
+
+
+def main():
+    rows = make_detection_rows()
+    for name, fn in (("before (jsonable_encoder + json)", before), ("after (orjson)", after)):
+        best = min(timeit.repeat(lambda: fn(rows), number=1, repeat=REPEAT))
+        print(f"{name:<34} {best * 1000:8.2f} ms per {ROWS} rows")
+
+
+if __name__ == '__main__':
+    main()
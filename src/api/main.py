@@ -7,22 +7,56 @@
   #  return {"message": "Hello from Medical Project API!"}
 
 import os
+import time
 import asyncio
+import threading
 import psycopg2
+import psycopg2.errors
 from psycopg2 import pool
+from psycopg2.extras import Json
 from dotenv import load_dotenv
-from fastapi import FastAPI, HTTPException, Depends
-from typing import List, Dict, Any, Optional
+from fastapi import FastAPI, HTTPException, Depends, BackgroundTasks
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import JSONResponse
+from typing import List, Any, Optional
+from decimal import Decimal
 import json 
+import orjson
+
+from .schemas import (
+    MessageOut, ChannelOut, ImageDetectionOut, MessageEngagementOut, ChannelEngagementOut
+)
 
 load_dotenv()
 
+# Responses smaller than this many bytes are sent uncompressed
+GZIP_MINIMUM_SIZE = int(os.getenv('API_GZIP_MINIMUM_SIZE', 1000))
+
+
+def _orjson_default(obj):
+    """Serializes the NUMERIC columns psycopg2 returns as Decimal."""
+    if isinstance(obj, Decimal):
+        return float(obj)
+    raise TypeError(f"Type is not JSON serializable: {type(obj).__name__}")
+
+
+class ORJSONResponse(JSONResponse):
+    """JSON response rendered with orjson, which natively handles datetime values."""
+
+    def render(self, content: Any) -> bytes:
+        return orjson.dumps(content, default=_orjson_default, option=orjson.OPT_NON_STR_KEYS)
+
+
 app = FastAPI(
     title="Ethiopian Medical Telegram Data API",
     description="API to access scraped and enriched Telegram data related to Ethiopian medical businesses.",
     version="1.0.0",
+    default_response_class=ORJSONResponse,
 )
 
+# Compresses large responses for clients that send Accept-Encoding: gzip
+app.add_middleware(GZipMiddleware, minimum_size=GZIP_MINIMUM_SIZE)
+
 # --- Database Configuration ---
 DB_HOST = os.getenv('DB_HOST', 'localhost')
 DB_NAME = os.getenv('DB_NAME')
@@ -30,6 +64,23 @@ DB_USER = os.getenv('DB_USER')
 DB_PASSWORD = os.getenv('DB_PASSWORD')
 DB_PORT = os.getenv('DB_PORT', '5432')
 
+# --- Query Guardrails ---
+# Statement timeout per endpoint, in milliseconds
+STATEMENT_TIMEOUTS_MS = {
+    'messages': int(os.getenv('API_MESSAGES_TIMEOUT_MS', 2000)),
+    'channels': int(os.getenv('API_CHANNELS_TIMEOUT_MS', 1000)),
+    'message_engagement': int(os.getenv('API_MESSAGE_ENGAGEMENT_TIMEOUT_MS', 2000)),
+    'channel_engagement': int(os.getenv('API_CHANNEL_ENGAGEMENT_TIMEOUT_MS', 5000)),
+    'image_detections': int(os.getenv('API_IMAGE_DETECTIONS_TIMEOUT_MS', 2000)),
+    'detection_classes': int(os.getenv('API_DETECTION_CLASSES_TIMEOUT_MS', 1000)),
+}
+# Queries slower than this get their EXPLAIN (ANALYZE, BUFFERS) plan saved to api_slow_queries
+SLOW_QUERY_THRESHOLD_MS = float(os.getenv('API_SLOW_QUERY_THRESHOLD_MS', 500))
+# Plan captures running at once; slow queries arriving while all slots are busy are not
+# captured, so a struggling database is not loaded with EXPLAIN ANALYZE re-runs
+SLOW_QUERY_CAPTURE_CONCURRENCY = int(os.getenv('API_SLOW_QUERY_CAPTURE_CONCURRENCY', 1))
+_capture_slots = threading.BoundedSemaphore(SLOW_QUERY_CAPTURE_CONCURRENCY)
+
 # Global connection pool
 db_pool = None
 
@@ -50,6 +101,32 @@ async def get_db_connection():
         if conn:
             await asyncio.to_thread(db_pool.putconn, conn)
 
+def ensure_slow_queries_table_exists(conn):
+    """
+    Ensures the api_slow_queries table exists in the database.
+    This table stores the plans of API queries slower than SLOW_QUERY_THRESHOLD_MS.
+    """
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS api_slow_queries (
+                id SERIAL PRIMARY KEY,
+                endpoint TEXT NOT NULL,
+                query_text TEXT NOT NULL,
+                duration_ms NUMERIC NOT NULL,
+                plan JSONB, -- EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) output
+                captured_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+            );
+        """)
+        conn.commit()
+        print("Ensured 'api_slow_queries' table exists.")
+    except Exception as e:
+        print(f"Error ensuring 'api_slow_queries' table exists: {e}")
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+
 # --- FastAPI Lifecycle Events ---
 @app.on_event("startup")
 async def startup_event():
@@ -68,7 +145,10 @@ async def startup_event():
         )
         # Test a connection to ensure it works
         conn = await asyncio.to_thread(db_pool.getconn)
-        await asyncio.to_thread(db_pool.putconn, conn)
+        try:
+            await asyncio.to_thread(ensure_slow_queries_table_exists, conn)
+        finally:
+            await asyncio.to_thread(db_pool.putconn, conn)
         print("Database connection pool initialized successfully.")
     except Exception as e:
         print(f"Failed to initialize database connection pool: {e}")
@@ -83,6 +163,102 @@ async def shutdown_event():
         await asyncio.to_thread(db_pool.closeall)
         print("Database connection pool closed.")
 
+# --- Response Helpers ---
+
+def select_columns(fields: Optional[str], schema, table_alias: str = "") -> str:
+    """
+    Builds the SELECT list for a comma separated `fields=` projection, so only the
+    requested columns are read from the database. Defaults to every field of the schema;
+    required fields (the row's key) are always selected.
+    """
+    allowed = list(schema.model_fields)
+    if fields:
+        requested = [f.strip() for f in fields.split(",") if f.strip()]
+        unknown = [f for f in requested if f not in allowed]
+        if unknown:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Unknown field(s): {', '.join(unknown)}. Allowed: {', '.join(allowed)}."
+            )
+        # Keep schema order and drop duplicates
+        allowed = [f for f in allowed if f in requested or schema.model_fields[f].is_required()]
+    prefix = f"{table_alias}." if table_alias else ""
+    return ", ".join(f"{prefix}{column}" for column in allowed)
+
+
+def like_prefix(value: str) -> str:
+    """Lower-cased LIKE pattern matching values that start with `value`, with wildcards escaped."""
+    escaped = value.lower().replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return f"{escaped}%"
+
+
+def capture_slow_query(endpoint: str, query_text: str, duration_ms: float):
+    """
+    Re-runs a slow query under EXPLAIN (ANALYZE, BUFFERS) on its own pooled connection
+    and stores the plan in api_slow_queries. Scheduled by run_query as a background task,
+    so it runs in a worker thread after the response has been sent.
+    """
+    if not _capture_slots.acquire(blocking=False):
+        print(f"Skipped plan capture of slow query on {endpoint}: another capture is running.")
+        return
+
+    conn = None
+    try:
+        conn = db_pool.getconn()
+        cursor = conn.cursor()
+        try:
+            cursor.execute("SET LOCAL statement_timeout = %s", (STATEMENT_TIMEOUTS_MS[endpoint],))
+            cursor.execute("EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) " + query_text)
+            plan = cursor.fetchone()[0]
+            cursor.execute("""
+                INSERT INTO api_slow_queries (endpoint, query_text, duration_ms, plan)
+                VALUES (%s, %s, %s, %s);
+            """, (endpoint, query_text, round(duration_ms, 3), Json(plan)))
+            conn.commit()
+            print(f"Slow query on {endpoint} ({duration_ms:.1f} ms) captured in api_slow_queries.")
+        finally:
+            cursor.close()
+    except Exception as e:
+        print(f"Error capturing slow query plan for {endpoint}: {e}")
+        if conn:
+            conn.rollback()
+    finally:
+        if conn:
+            db_pool.putconn(conn)
+        _capture_slots.release()
+
+
+def run_query(cursor, endpoint: str, query: str, params=None, background_tasks: Optional[BackgroundTasks] = None):
+    """
+    Executes an endpoint query under the endpoint's statement timeout.
+    Queries slower than SLOW_QUERY_THRESHOLD_MS get their plan captured by a
+    background task, off the request path.
+    """
+    timeout_ms = STATEMENT_TIMEOUTS_MS[endpoint]
+    # SET LOCAL only lasts until the pool rolls the transaction back on putconn
+    cursor.execute("SET LOCAL statement_timeout = %s", (timeout_ms,))
+
+    started = time.perf_counter()
+    try:
+        cursor.execute(query, params)
+    except psycopg2.errors.QueryCanceled:
+        raise HTTPException(status_code=504, detail=f"Query exceeded the {timeout_ms} ms timeout for {endpoint}.")
+    duration_ms = (time.perf_counter() - started) * 1000
+
+    if duration_ms >= SLOW_QUERY_THRESHOLD_MS and background_tasks is not None:
+        query_text = cursor.mogrify(query, params).decode()
+        background_tasks.add_task(capture_slow_query, endpoint, query_text, duration_ms)
+
+
+def rows_response(cursor) -> ORJSONResponse:
+    """
+    Serializes the fetched rows straight to JSON with orjson. The columns are already
+    typed by the SQL query, so rows skip per-row validation against the response model,
+    which is still used for the OpenAPI schema.
+    """
+    columns = [desc[0] for desc in cursor.description]
+    return ORJSONResponse([dict(zip(columns, row)) for row in cursor.fetchall()])
+
 # --- API Endpoints ---
 
 @app.get("/", summary="Root endpoint for API status")
@@ -92,41 +268,37 @@ async def read_root():
 
 # -----------------------------------------------------------------------------
 
-@app.get("/messages", response_model=List[Dict[str, Any]], summary="Retrieve recent Telegram messages")
+@app.get("/messages", response_model=List[MessageOut], summary="Retrieve recent Telegram messages")
 async def get_messages(
+    background_tasks: BackgroundTasks,
     limit: int = 10,
     offset: int = 0,
     channel_username: Optional[str] = None, # New optional filter
     min_views: Optional[int] = None,       # New optional filter
+    fields: Optional[str] = None,          # Comma separated columns to return
     conn: psycopg2.extensions.connection = Depends(get_db_connection)
 ):
     """
     Retrieves recent messages from the `fct_messages` table.
-    Allows filtering by `channel_username` and `min_views`.
+    Allows filtering by `channel_username` (exact, case-insensitive) and `min_views`, and
+    returning only some columns with `fields` (e.g. `fields=message_id,views_count`).
     """
     if not (1 <= limit <= 100):
         raise HTTPException(status_code=400, detail="Limit must be between 1 and 100.")
+    columns = select_columns(fields, MessageOut)
 
     cursor = conn.cursor()
     try:
-        query = """
-            SELECT
-                message_id,
-                channel_username,
-                message_text,
-                message_date,
-                views_count,
-                forwards_count,
-                link,
-                has_media -- Assuming you added this to fct_messages or can infer from local_media_path in raw
+        query = f"""
+            SELECT {columns}
             FROM fct_messages
             WHERE 1=1
         """
         params = []
 
         if channel_username:
-            query += " AND channel_username ILIKE %s"
-            params.append(f"%{channel_username}%")
+            query += " AND lower(channel_username) = lower(%s)"
+            params.append(channel_username)
         if min_views is not None:
             query += " AND views_count >= %s"
             params.append(min_views)
@@ -134,12 +306,10 @@ async def get_messages(
         query += " ORDER BY message_date DESC LIMIT %s OFFSET %s;"
         params.extend([limit, offset])
 
-        cursor.execute(query, tuple(params))
-        messages = cursor.fetchall()
-        columns = [desc[0] for desc in cursor.description]
-        result = [dict(zip(columns, row)) for row in messages]
-
-        return result
+        run_query(cursor, 'messages', query, tuple(params), background_tasks)
+        return rows_response(cursor)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error retrieving messages: {e}")
     finally:
@@ -147,31 +317,29 @@ async def get_messages(
 
 # -----------------------------------------------------------------------------
 
-@app.get("/channels", response_model=List[Dict[str, Any]], summary="Retrieve unique channels")
+@app.get("/channels", response_model=List[ChannelOut], summary="Retrieve unique channels")
 async def get_channels(
+    background_tasks: BackgroundTasks,
+    fields: Optional[str] = None,
     conn: psycopg2.extensions.connection = Depends(get_db_connection)
 ):
     """
     Retrieves a list of unique channels from the `dim_channels` table.
-    Ordered by total messages.
+    Ordered by total messages. `fields` limits the returned columns.
     """
+    columns = select_columns(fields, ChannelOut)
+
     cursor = conn.cursor()
     try:
-        query = """
-            SELECT
-                channel_id,
-                channel_username,
-                first_message_date,
-                last_message_date,
-                total_messages
+        query = f"""
+            SELECT {columns}
             FROM dim_channels
             ORDER BY total_messages DESC;
         """
-        cursor.execute(query)
-        channels = cursor.fetchall()
-        columns = [desc[0] for desc in cursor.description]
-        result = [dict(zip(columns, row)) for row in channels]
-        return result
+        run_query(cursor, 'channels', query, background_tasks=background_tasks)
+        return rows_response(cursor)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error retrieving channels: {e}")
     finally:
@@ -179,62 +347,140 @@ async def get_channels(
 
 # -----------------------------------------------------------------------------
 
-@app.get("/image_detections", response_model=List[Dict[str, Any]], summary="Retrieve object detection results from images")
+@app.get("/messages/{message_id}/engagement", response_model=List[MessageEngagementOut], summary="Retrieve the view-growth curve of a message")
+async def get_message_engagement(
+    message_id: int,
+    background_tasks: BackgroundTasks,
+    conn: psycopg2.extensions.connection = Depends(get_db_connection)
+):
+    """
+    Retrieves the engagement snapshots of a single message from the `fct_message_engagement` view,
+    oldest first. A snapshot exists for every refresh in which the counts changed.
+    """
+    cursor = conn.cursor()
+    try:
+        query = """
+            SELECT
+                captured_at,
+                views_count,
+                forwards_count,
+                replies_count,
+                views_delta,
+                forwards_delta
+            FROM fct_message_engagement
+            WHERE message_id = %s
+            ORDER BY captured_at;
+        """
+        run_query(cursor, 'message_engagement', query, (message_id,), background_tasks)
+        if cursor.rowcount == 0:
+            raise HTTPException(status_code=404, detail=f"No engagement data for message {message_id}.")
+        return rows_response(cursor)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error retrieving message engagement: {e}")
+    finally:
+        cursor.close()
+
+# -----------------------------------------------------------------------------
+
+@app.get("/channels/{channel_username}/engagement", response_model=List[ChannelEngagementOut], summary="Retrieve daily view growth of a channel")
+async def get_channel_engagement(
+    channel_username: str,
+    background_tasks: BackgroundTasks,
+    days: int = 30,
+    conn: psycopg2.extensions.connection = Depends(get_db_connection)
+):
+    """
+    Retrieves views and forwards gained per day across all messages of a channel,
+    computed from the `fct_message_engagement` snapshots of the last `days` days.
+    The channel is looked up in `dim_channels` (exact, case-insensitive).
+    """
+    if not (1 <= days <= 365):
+        raise HTTPException(status_code=400, detail="Days must be between 1 and 365.")
+
+    cursor = conn.cursor()
+    try:
+        run_query(cursor, 'channel_engagement', """
+            SELECT channel_id
+            FROM dim_channels
+            WHERE lower(channel_username) = lower(%s);
+        """, (channel_username,), background_tasks)
+        channel = cursor.fetchone()
+        if channel is None:
+            raise HTTPException(status_code=404, detail=f"Channel '{channel_username}' not found.")
+
+        # Filtering on channel_id, a partition column of the view's window, lets Postgres
+        # read only this channel's snapshots instead of computing deltas for every message
+        query = """
+            SELECT
+                DATE_TRUNC('day', captured_at)::DATE AS day,
+                COUNT(DISTINCT message_id) AS messages_updated,
+                COALESCE(SUM(views_delta), 0) AS views_gained,
+                COALESCE(SUM(forwards_delta), 0) AS forwards_gained
+            FROM fct_message_engagement
+            WHERE channel_id = %s
+                AND captured_at >= NOW() - %s * INTERVAL '1 day'
+            GROUP BY 1
+            ORDER BY 1;
+        """
+        run_query(cursor, 'channel_engagement', query, (channel[0], days), background_tasks)
+        return rows_response(cursor)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error retrieving channel engagement: {e}")
+    finally:
+        cursor.close()
+
+# -----------------------------------------------------------------------------
+
+@app.get("/image_detections", response_model=List[ImageDetectionOut], summary="Retrieve object detection results from images")
 async def get_image_detections(
+    background_tasks: BackgroundTasks,
     limit: int = 10,
     offset: int = 0,
     object_class: Optional[str] = None,
     min_confidence: float = 0.0,
     channel_username: Optional[str] = None, # New filter for image detections
+    fields: Optional[str] = None,          # Comma separated columns to return
     conn: psycopg2.extensions.connection = Depends(get_db_connection)
 ):
     """
     Retrieves object detection results from the `fct_image_detections` table.
-    Allows filtering by `object_class`, `min_confidence`, and `channel_username`.
+    Allows filtering by `object_class` (prefix, case-insensitive), `min_confidence`,
+    and `channel_username` (exact, case-insensitive), and returning only some columns with `fields`.
     """
     if not (1 <= limit <= 100):
         raise HTTPException(status_code=400, detail="Limit must be between 1 and 100.")
+    columns = select_columns(fields, ImageDetectionOut, table_alias="fid")
 
     cursor = conn.cursor()
     try:
-        query = """
-            SELECT
-                fid.image_detection_id,
-                fid.message_id,
-                fid.detected_message_date,
-                fid.channel_username,
-                fid.image_path,
-                fid.detected_object_class,
-                fid.confidence_score,
-                fid.box_xmin,
-                fid.box_ymin,
-                fid.box_xmax,
-                fid.box_ymax,
-                fid.detection_timestamp
+        query = f"""
+            SELECT {columns}
             FROM fct_image_detections fid
             WHERE 1=1
         """
         params = []
 
         if object_class:
-            query += " AND fid.detected_object_class ILIKE %s"
-            params.append(f"%{object_class}%")
+            query += " AND lower(fid.detected_object_class) LIKE %s"
+            params.append(like_prefix(object_class))
         if min_confidence > 0:
             query += " AND fid.confidence_score >= %s"
             params.append(min_confidence)
         if channel_username:
-            query += " AND fid.channel_username ILIKE %s"
-            params.append(f"%{channel_username}%")
+            query += " AND lower(fid.channel_username) = lower(%s)"
+            params.append(channel_username)
 
         query += " ORDER BY fid.detection_timestamp DESC LIMIT %s OFFSET %s;"
         params.extend([limit, offset])
 
-        cursor.execute(query, tuple(params))
-        detections = cursor.fetchall()
-        columns = [desc[0] for desc in cursor.description]
-        result = [dict(zip(columns, row)) for row in detections]
-
-        return result
+        run_query(cursor, 'image_detections', query, tuple(params), background_tasks)
+        return rows_response(cursor)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error retrieving image detections: {e}")
     finally:
@@ -244,6 +490,7 @@ async def get_image_detections(
 
 @app.get("/image_detections/classes", response_model=List[str], summary="Retrieve unique detected object classes")
 async def get_detection_classes(
+    background_tasks: BackgroundTasks,
     conn: psycopg2.extensions.connection = Depends(get_db_connection)
 ):
     """
@@ -251,14 +498,37 @@ async def get_detection_classes(
     """
     cursor = conn.cursor()
     try:
+        # Loose index scan: jumps from one class to the next through the
+        # detected_object_class index instead of reading every detection
         query = """
-            SELECT DISTINCT detected_object_class
-            FROM fct_image_detections
-            ORDER BY detected_object_class;
+            WITH RECURSIVE classes AS (
+                (
+                    SELECT detected_object_class
+                    FROM fct_image_detections
+                    WHERE detected_object_class IS NOT NULL
+                    ORDER BY detected_object_class
+                    LIMIT 1
+                )
+                UNION ALL
+                SELECT (
+                    SELECT fid.detected_object_class
+                    FROM fct_image_detections fid
+                    WHERE fid.detected_object_class > classes.detected_object_class
+                    ORDER BY fid.detected_object_class
+                    LIMIT 1
+                )
+                FROM classes
+                WHERE classes.detected_object_class IS NOT NULL
+            )
+            SELECT detected_object_class
+            FROM classes
+            WHERE detected_object_class IS NOT NULL;
         """
-        cursor.execute(query)
+        run_query(cursor, 'detection_classes', query, background_tasks=background_tasks)
         classes = [row[0] for row in cursor.fetchall()]
         return classes
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error retrieving detection classes: {e}")
     finally:
@@ -1 +1,68 @@
-# API schemas
\ No newline at end of file
+# API schemas
+
+from datetime import date, datetime
+from typing import Optional
+from pydantic import BaseModel
+
+# Required fields are the row's key and are always returned. The other fields are Optional
+# so that rows projected with `fields=` still match the schema; unrequested fields are left
+# out of the response instead of being sent as null. Rows are serialized without validation,
+# so these models document the responses (OpenAPI) and define the columns `fields=` accepts.
+
+
+class MessageOut(BaseModel):
+    """A row of the `fct_messages` table as returned by `/messages`."""
+    message_id: int
+    channel_username: Optional[str] = None
+    message_text: Optional[str] = None
+    message_date: Optional[datetime] = None
+    views_count: Optional[int] = None
+    forwards_count: Optional[int] = None
+    link: Optional[str] = None
+    has_media: Optional[bool] = None
+
+
+class ChannelOut(BaseModel):
+    """A row of the `dim_channels` table as returned by `/channels`."""
+    channel_id: int
+    channel_name: Optional[str] = None
+    channel_username: Optional[str] = None
+    first_message_date: Optional[datetime] = None
+    last_message_date: Optional[datetime] = None
+    total_messages: Optional[int] = None
+
+
+class ImageDetectionOut(BaseModel):
+    """A row of the `fct_image_detections` table as returned by `/image_detections`."""
+    image_detection_id: int
+    message_id: Optional[int] = None
+    detected_message_date: Optional[datetime] = None
+    channel_username: Optional[str] = None
+    image_path: Optional[str] = None
+    image_cluster_id: Optional[int] = None
+    is_repost: Optional[bool] = None
+    detected_object_class: Optional[str] = None
+    confidence_score: Optional[float] = None
+    box_xmin: Optional[float] = None
+    box_ymin: Optional[float] = None
+    box_xmax: Optional[float] = None
+    box_ymax: Optional[float] = None
+    detection_timestamp: Optional[datetime] = None
+
+
+class MessageEngagementOut(BaseModel):
+    """An engagement snapshot of a message from `fct_message_engagement`."""
+    captured_at: datetime
+    views_count: Optional[int] = None
+    forwards_count: Optional[int] = None
+    replies_count: Optional[int] = None
+    views_delta: Optional[int] = None
+    forwards_delta: Optional[int] = None
+
+
+class ChannelEngagementOut(BaseModel):
+    """Views and forwards gained by a channel on one day."""
+    day: date
+    messages_updated: int
+    views_gained: int
+    forwards_gained: int
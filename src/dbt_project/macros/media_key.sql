@@ -0,0 +1,10 @@
+-- macros/media_key.sql
+-- Path of a media file relative to the telegram_media download directory. Stored paths
+-- differ in prefix (relative paths from older scrapes, absolute paths on other hosts or
+-- containers), so images are matched on this key instead of the full path.
+{% macro media_key(path_column) %}
+    COALESCE(
+        SUBSTRING(REPLACE({{ path_column }}, '\', '/') FROM 'telegram_media/(.*)$'),
+        REPLACE({{ path_column }}, '\', '/')
+    )
+{% endmacro %}
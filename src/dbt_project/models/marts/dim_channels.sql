@@ -1,12 +1,17 @@
-
 -- models/marts/dim_channels.sql
 
-SELECT DISTINCT
+SELECT
     channel_id AS channel_id,
     CASE
         WHEN channel_id = 2398372400 THEN 'Lobelia Cosmetics Channel'
         WHEN channel_id = 2106543498 THEN 'Tikvah Pharma Channel'
         WHEN channel_id = 1271266957 THEN 'WHO News Channel'
         ELSE 'Unknown Channel' 
-    END AS channel_name
-FROM {{ ref('stg_telegrammessages') }}
\ No newline at end of file
+    END AS channel_name,
+    -- Latest username, in case the channel was renamed
+    (ARRAY_AGG(channel_username ORDER BY message_date DESC NULLS LAST))[1] AS channel_username,
+    MIN(message_date) AS first_message_date,
+    MAX(message_date) AS last_message_date,
+    COUNT(*) AS total_messages
+FROM {{ ref('stg_telegrammessages') }}
+GROUP BY channel_id
@@ -0,0 +1,19 @@
+-- models/marts/dim_images.sql
+{{ config(
+    materialized='table',
+    indexes=[
+        {'columns': ['media_key']},
+    ]
+) }}
+
+SELECT
+    rih.image_path,
+    {{ media_key('rih.image_path') }} AS media_key,
+    rih.dhash,
+    rih.cluster_id AS image_cluster_id,
+    FIRST_VALUE(rih.image_path) OVER (
+        PARTITION BY rih.cluster_id ORDER BY rih.hashed_at, rih.image_path
+    ) AS canonical_image_path,
+    COUNT(*) OVER (PARTITION BY rih.cluster_id) AS cluster_size,
+    rih.hashed_at
+FROM {{ source('telegram', 'raw_image_hashes') }} rih
@@ -0,0 +1,43 @@
+-- models/marts/fct_image_detections.sql
+-- Indexes back the filters and sort order of the API's /image_detections endpoints
+{{ config(
+    materialized='table',
+    indexes=[
+        {'columns': ['detection_timestamp']},
+        {'columns': ['lower(detected_object_class) text_pattern_ops', 'detection_timestamp']},
+        {'columns': ['lower(channel_username)', 'detection_timestamp']},
+        {'columns': ['detected_object_class']},
+        {'columns': ['image_cluster_id']},
+    ]
+) }}
+
+SELECT
+    ROW_NUMBER() OVER (ORDER BY rid.id, obj.ordinality) AS image_detection_id,
+    rid.id AS detection_id,
+    rid.message_id,
+    stg.message_date AS detected_message_date,
+    stg.channel_username,
+    rid.image_path,
+    di.image_cluster_id,
+    -- Reposts carry the detections of the first image of their cluster; filter them
+    -- out (or count distinct image_cluster_id) to count each picture once
+    di.image_cluster_id IS NOT NULL
+        AND rid.id <> MIN(rid.id) OVER (PARTITION BY di.image_cluster_id) AS is_repost,
+    obj.value ->> 'class_name' AS detected_object_class,
+    (obj.value ->> 'confidence')::NUMERIC AS confidence_score,
+    obj.value -> 'bbox' AS bounding_box, 
+    (obj.value -> 'bbox' ->> 0)::NUMERIC AS box_xmin,
+    (obj.value -> 'bbox' ->> 1)::NUMERIC AS box_ymin,
+    (obj.value -> 'bbox' ->> 2)::NUMERIC AS box_xmax,
+    (obj.value -> 'bbox' ->> 3)::NUMERIC AS box_ymax,
+    rid.detection_timestamp
+FROM
+    {{ source('telegram', 'raw_image_detections') }} rid
+    CROSS JOIN LATERAL jsonb_array_elements(rid.detected_objects) WITH ORDINALITY AS obj(value, ordinality)
+    LEFT JOIN {{ ref('stg_telegrammessages') }} stg
+        ON stg.message_id = rid.message_id
+    LEFT JOIN {{ ref('dim_images') }} di
+        ON di.media_key = {{ media_key('rid.image_path') }}
+WHERE
+    rid.detected_objects IS NOT NULL
+    AND jsonb_typeof(rid.detected_objects) = 'array'
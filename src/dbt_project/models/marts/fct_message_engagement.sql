@@ -0,0 +1,24 @@
+-- models/marts/fct_message_engagement.sql
+-- View so the API sees snapshots appended by the engagement refresher without a dbt run
+{{ config(materialized='view') }}
+
+SELECT
+    snap.message_id,
+    snap.channel_id,
+    stg.channel_username,
+    stg.message_date,
+    snap.captured_at,
+    snap.views_count,
+    snap.forwards_count,
+    snap.replies_count,
+    snap.views_count - LAG(snap.views_count) OVER w AS views_delta,
+    snap.forwards_count - LAG(snap.forwards_count) OVER w AS forwards_delta
+FROM {{ source('telegram', 'raw_engagement_snapshots') }} snap
+-- LEFT JOIN on the unique message_id, so queries that do not select the
+-- message columns skip the join entirely
+LEFT JOIN {{ ref('stg_telegrammessages') }} stg
+    ON stg.message_id = snap.message_id
+-- A message belongs to one channel, so adding channel_id does not change the partitions.
+-- Filters on a window's partition columns are pushed below the window, so queries by
+-- message_id or channel_id read only that message's or channel's snapshots through an index.
+WINDOW w AS (PARTITION BY snap.channel_id, snap.message_id ORDER BY snap.captured_at)
@@ -1,10 +1,22 @@
 -- models/marts/fct_messages.sql
+-- Indexes back the filters and sort order of the API's /messages endpoint
+{{ config(
+    materialized='table',
+    indexes=[
+        {'columns': ['message_id'], 'unique': True},
+        {'columns': ['message_date']},
+        {'columns': ['lower(channel_username)', 'message_date']},
+        {'columns': ['views_count']},
+    ]
+) }}
 
 SELECT
     stg.message_id,
     stg.channel_id AS channel_id, 
+    stg.channel_username,
     TO_CHAR(stg.message_date, 'YYYYMMDD')::INTEGER AS date_key, 
     stg.message_text,
+    stg.message_date,
     stg.message_date AS message_timestamp, 
     stg.sender_id,
     stg.sender_username,
@@ -14,5 +26,6 @@ SELECT
     stg.reactions_count,
     stg.link,
     stg.media_data,
+    stg.media_data IS NOT NULL AS has_media,
     LENGTH(stg.message_text) AS message_length
-FROM {{ ref('stg_telegrammessages') }} stg
\ No newline at end of file
+FROM {{ ref('stg_telegrammessages') }} stg
@@ -0,0 +1,16 @@
+-- models/marts/fct_product_mentions.sql
+
+SELECT
+    rpm.id AS product_mention_id,
+    rpm.message_id,
+    fm.channel_id,
+    fm.date_key,
+    fm.message_timestamp,
+    rpm.product_name,
+    rpm.product_category,
+    rpm.matched_text,
+    rpm.price_etb,
+    rpm.extracted_at
+FROM {{ source('telegram', 'raw_product_mentions') }} rpm
+JOIN {{ ref('fct_messages') }} fm
+    ON fm.message_id = rpm.message_id
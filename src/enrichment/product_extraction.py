@@ -0,0 +1,350 @@
+import os
+import re
+import asyncio
+import csv
+import time
+import psycopg2
+from psycopg2.extras import execute_values
+from concurrent.futures import ProcessPoolExecutor
+from decimal import Decimal, InvalidOperation
+from dotenv import load_dotenv
+import ahocorasick
+
+load_dotenv()
+
+# --- Database Configuration ---
+DB_HOST = os.getenv('DB_HOST', 'localhost')
+DB_NAME = os.getenv('DB_NAME')
+DB_USER = os.getenv('DB_USER')
+DB_PASSWORD = os.getenv('DB_PASSWORD')
+DB_PORT = os.getenv('DB_PORT', '5432')
+
+print(f"DEBUG (Products): Attempting to connect to DB_HOST: {DB_HOST}")
+
+# --- Extraction Configuration ---
+PRODUCT_DICTIONARY_PATH = os.getenv(
+    'PRODUCT_DICTIONARY_PATH',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'product_dictionary.csv')
+)
+PRODUCT_EXTRACTION_WORKERS = int(os.getenv('PRODUCT_EXTRACTION_WORKERS', os.cpu_count() or 1))
+# Messages handed to a worker process at a time
+PRODUCT_EXTRACTION_CHUNK_SIZE = int(os.getenv('PRODUCT_EXTRACTION_CHUNK_SIZE', 5000))
+# A price is attached to a product if it starts within this many characters after the product name
+# and before the next product mentioned
+PRICE_MAX_DISTANCE = 80
+
+# Amounts like 1200, 1,200 or 1200.50
+_AMOUNT = r"\d{1,3}(?:,\d{3})+(?:\.\d+)?|\d+(?:\.\d+)?"
+# Ethiopic script letters (Ethiopic and Ethiopic Supplement blocks)
+_ETHIOPIC = "\u1200-\u135a\u1380-\u139f"
+# ETB, Birr, Br and the Amharic ብር (birr), as whole words so "cobra 300" is not a price
+_CURRENCY = rf"(?:(?<![a-z])(?:etb|birr|br)(?![a-z])\.?|ብር(?![{_ETHIOPIC}]))"
+# ASCII separators and the Ethiopic wordspace, comma, semicolons and preface colon (፡ ፣ ፤ ፥ ፦)
+_LABEL_SEPARATOR = r"[:\-=፡፣፤፥፦]"
+PRICE_PATTERN = re.compile(
+    rf"(?:{_CURRENCY}\s*(?P<before>{_AMOUNT}))"                                   # ETB 1,200
+    rf"|(?:(?P<after>{_AMOUNT})\s*{_CURRENCY})"                                   # 1200 birr / 1200ብር
+    rf"|(?:(?:price|ዋጋ)\s*{_LABEL_SEPARATOR}?\s*(?P<labelled>{_AMOUNT}))",        # Price: 1200 / ዋጋ፦ 1200
+    re.IGNORECASE
+)
+
+# Amharic attaches prepositions and case/plural endings to the noun (በፓናዶል, ፓናዶልን),
+# so an Ethiopic alias may be preceded or followed by one of these inside the same word
+AMHARIC_PREFIXES = ('በ', 'ለ', 'ከ', 'የ', 'ስለ', 'ወደ', 'እንደ')
+AMHARIC_SUFFIXES = ('ን', 'ም', 'ና', 'ው', 'ስ', 'ንም', 'ውን', 'ዎች', 'ዎቹ', 'ዎችን')
+
+# Automaton of the worker process, built once by _init_worker
+_automaton = None
+
+
+def get_db_connection(retries=5, delay=3):
+    """
+    Establishes and returns a database connection with retries.
+    """
+    if not all([DB_NAME, DB_USER, DB_PASSWORD, DB_HOST, DB_PORT]):
+        raise ValueError("Missing one or more database environment variables. Check your .env file.")
+
+    for i in range(retries):
+        try:
+            conn = psycopg2.connect(
+                host=DB_HOST,
+                database=DB_NAME,
+                user=DB_USER,
+                password=DB_PASSWORD,
+                port=DB_PORT
+            )
+
+            return conn
+        except psycopg2.OperationalError as e:
+            if "could not translate host name" in str(e) or "Is the server running on host" in str(e):
+                print(f"Attempt {i+1}/{retries}: Database not ready yet ({e}). Retrying in {delay} seconds...")
+                time.sleep(delay)
+            else:
+                raise e
+        except Exception as e:
+            raise e
+
+    raise Exception(f"Failed to connect to database after {retries} attempts.")
+
+
+async def ensure_product_mentions_tables_exist():
+    """
+    Ensures the raw_product_mentions and raw_product_extraction_log tables exist.
+    The log records every message that was scanned, with or without mentions,
+    so each run only reads messages it has not seen yet.
+    """
+    conn = None
+    try:
+        conn = get_db_connection()
+        cur = conn.cursor()
+        create_table_query = """
+        CREATE TABLE IF NOT EXISTS raw_product_mentions (
+            id SERIAL PRIMARY KEY,
+            message_id BIGINT NOT NULL,
+            product_name TEXT NOT NULL,
+            product_category TEXT,
+            matched_text TEXT,
+            match_position INTEGER,
+            price_etb NUMERIC(12, 2),
+            extracted_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+            UNIQUE (message_id, product_name, match_position)
+        );
+        CREATE TABLE IF NOT EXISTS raw_product_extraction_log (
+            message_id BIGINT PRIMARY KEY,
+            mention_count INTEGER NOT NULL,
+            processed_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+        );
+        """
+        cur.execute(create_table_query)
+        conn.commit()
+        print("Ensured 'raw_product_mentions' and 'raw_product_extraction_log' tables exist.")
+    except Exception as e:
+        print(f"Error ensuring product mention tables exist: {e}")
+        if conn:
+            conn.rollback()
+        raise
+    finally:
+        if conn:
+            cur.close()
+            conn.close()
+
+
+def write_product_mentions(conn, processed_ids, mentions):
+    """Bulk-inserts the mentions of a batch and marks all its messages as processed."""
+    cur = conn.cursor()
+    try:
+        if mentions:
+            execute_values(cur, """
+                INSERT INTO raw_product_mentions (
+                    message_id, product_name, product_category, matched_text, match_position, price_etb
+                ) VALUES %s
+                ON CONFLICT (message_id, product_name, match_position) DO NOTHING;
+            """, mentions, page_size=1000)
+        execute_values(cur, """
+            INSERT INTO raw_product_extraction_log (message_id, mention_count)
+            VALUES %s
+            ON CONFLICT (message_id) DO NOTHING;
+        """, processed_ids, page_size=1000)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+
+
+# --- Extraction Logic ---
+
+def load_product_dictionary(path=PRODUCT_DICTIONARY_PATH):
+    """Returns a list of (alias, product_name, category) from the curated dictionary CSV."""
+    entries = []
+    with open(path, newline='', encoding='utf-8') as f:
+        for row in csv.DictReader(f):
+            for alias in row['aliases'].split('|'):
+                alias = alias.strip().lower()
+                if alias:
+                    entries.append((alias, row['product_name'], row['category']))
+    return entries
+
+
+def build_automaton(entries):
+    """Compiles the dictionary aliases into a single Aho-Corasick automaton."""
+    automaton = ahocorasick.Automaton()
+    for alias, product_name, category in entries:
+        automaton.add_word(alias, (len(alias), product_name, category))
+    automaton.make_automaton()
+    return automaton
+
+
+def _is_ethiopic(char):
+    return '\u1200' <= char <= '\u135a' or '\u1380' <= char <= '\u139f'
+
+
+def _is_whole_word(text, start, end):
+    """
+    True if text[start:end] is a whole word. For Ethiopic aliases the word may also carry
+    one of the common Amharic prefixes or suffixes.
+    """
+    word_start = start
+    while word_start > 0 and text[word_start - 1].isalnum():
+        word_start -= 1
+    word_end = end
+    while word_end < len(text) and text[word_end].isalnum():
+        word_end += 1
+
+    prefix = text[word_start:start]
+    suffix = text[end:word_end]
+    if not prefix and not suffix:
+        return True
+    if not _is_ethiopic(text[start]):
+        return False
+    return (not prefix or prefix in AMHARIC_PREFIXES) and (not suffix or suffix in AMHARIC_SUFFIXES)
+
+
+def parse_amount(amount):
+    """Converts an amount such as '1,200' or '1200.50' to a Decimal, or None."""
+    try:
+        return Decimal(amount.replace(",", ""))
+    except InvalidOperation:
+        return None
+
+
+def extract_prices(text):
+    """Returns a list of (start_position, Decimal amount in ETB) found in the text."""
+    prices = []
+    for match in PRICE_PATTERN.finditer(text):
+        amount = parse_amount(match.group('before') or match.group('after') or match.group('labelled'))
+        if amount is not None and amount > 0:
+            prices.append((match.start(), amount))
+    return prices
+
+
+def extract_mentions(automaton, message_id, text):
+    """
+    Finds dictionary products in a message and pairs each with the nearest price after it,
+    up to the next product mentioned. Overlapping matches are resolved in favour of the longest alias.
+    """
+    lowered = text.lower()
+    candidates = []
+    for end_index, (length, product_name, category) in automaton.iter(lowered):
+        start = end_index - length + 1
+        if _is_whole_word(lowered, start, end_index + 1):
+            candidates.append((start, length, product_name, category))
+
+    if not candidates:
+        return []
+
+    candidates.sort(key=lambda c: (c[0], -c[1]))
+    prices = extract_prices(lowered)
+
+    # Overlapping matches are dropped, keeping the longest alias at each position
+    accepted = []
+    covered_until = -1
+    for start, length, product_name, category in candidates:
+        if start <= covered_until:
+            continue
+        covered_until = start + length - 1
+        accepted.append((start, length, product_name, category))
+
+    mentions = []
+    for i, (start, length, product_name, category) in enumerate(accepted):
+        end = start + length - 1
+        window_end = end + PRICE_MAX_DISTANCE
+        if i + 1 < len(accepted):
+            # A price after the next product belongs to that product
+            window_end = min(window_end, accepted[i + 1][0] - 1)
+        price = next(
+            (amount for position, amount in prices if end < position <= window_end),
+            None
+        )
+        mentions.append((message_id, product_name, category, lowered[start:start + length], start, price))
+    return mentions
+
+
+def _init_worker(dictionary_path):
+    global _automaton
+    _automaton = build_automaton(load_product_dictionary(dictionary_path))
+
+
+def process_chunk(rows):
+    """Worker entry point: returns (processed_ids, mentions) for a chunk of (message_id, message_text)."""
+    processed_ids = []
+    mentions = []
+    for message_id, text in rows:
+        message_mentions = extract_mentions(_automaton, message_id, text) if text else []
+        processed_ids.append((message_id, len(message_mentions)))
+        mentions.extend(message_mentions)
+    return processed_ids, mentions
+
+
+def extract_product_mentions():
+    """
+    Scans every fct_messages row not yet in raw_product_extraction_log, in chunks
+    spread across a process pool, and bulk-writes the mentions found.
+    """
+    read_conn = get_db_connection()
+    write_conn = get_db_connection()
+    # Server-side cursor so the whole backlog is never loaded into memory
+    read_cur = read_conn.cursor(name='product_extraction')
+    read_cur.itersize = PRODUCT_EXTRACTION_CHUNK_SIZE
+
+    total_messages = 0
+    total_mentions = 0
+    started = time.monotonic()
+    try:
+        read_cur.execute("""
+            SELECT
+                fm.message_id,
+                fm.message_text
+            FROM
+                fct_messages fm
+            LEFT JOIN
+                raw_product_extraction_log log ON fm.message_id = log.message_id
+            WHERE
+                log.message_id IS NULL; -- Only messages that have not been scanned yet
+        """)
+
+        batch_size = PRODUCT_EXTRACTION_CHUNK_SIZE * PRODUCT_EXTRACTION_WORKERS
+        with ProcessPoolExecutor(
+            max_workers=PRODUCT_EXTRACTION_WORKERS,
+            initializer=_init_worker,
+            initargs=(PRODUCT_DICTIONARY_PATH,)
+        ) as executor:
+            while True:
+                rows = read_cur.fetchmany(batch_size)
+                if not rows:
+                    break
+                chunks = [
+                    rows[i:i + PRODUCT_EXTRACTION_CHUNK_SIZE]
+                    for i in range(0, len(rows), PRODUCT_EXTRACTION_CHUNK_SIZE)
+                ]
+                for processed_ids, mentions in executor.map(process_chunk, chunks):
+                    write_product_mentions(write_conn, processed_ids, mentions)
+                    total_messages += len(processed_ids)
+                    total_mentions += len(mentions)
+
+                elapsed = time.monotonic() - started
+                print(f"Scanned {total_messages} message(s), {total_mentions} product mention(s) "
+                      f"({total_messages / max(elapsed, 1e-9) * 60:.0f} messages/min).")
+    finally:
+        read_cur.close()
+        read_conn.close()
+        write_conn.close()
+
+    print(f"Finished product extraction: {total_mentions} mention(s) in {total_messages} new message(s).")
+    return total_messages, total_mentions
+
+
+async def run_product_extraction():
+    """Main function to ensure the tables exist and extract mentions from new messages."""
+    await ensure_product_mentions_tables_exist()
+    extract_product_mentions()
+
+
+if __name__ == '__main__':
+
+    if not all([DB_NAME, DB_USER, DB_PASSWORD, DB_HOST, DB_PORT]):
+        print("Error: Missing required database environment variables. Check your .env file.")
+        print("Required: DB_NAME, DB_USER, DB_PASSWORD, DB_HOST, DB_PORT")
+    else:
+        asyncio.run(run_product_extraction())
@@ -0,0 +1,334 @@
+import os
+import asyncio
+import itertools
+from datetime import datetime, timezone
+from telethon.sync import TelegramClient
+from telethon.tl import functions
+from telethon.tl.types import PeerChannel
+from psycopg2.extras import execute_values
+from dotenv import load_dotenv
+
+from utils import get_db_connection, DB_NAME, DB_USER, DB_PASSWORD
+
+load_dotenv()
+
+# --- Refresh Configuration ---
+# Messages posted within this many days get their counts re-polled
+ENGAGEMENT_REFRESH_DAYS = int(os.getenv('ENGAGEMENT_REFRESH_DAYS', 7))
+# Seconds between refreshes when running alongside the scraper (0 = disabled)
+ENGAGEMENT_REFRESH_INTERVAL = int(os.getenv('ENGAGEMENT_REFRESH_INTERVAL', 3600))
+# messages.getMessagesViews accepts at most 100 ids per call
+VIEWS_BATCH_SIZE = 100
+# schema_migrations entry of the one-time snapshot channel_id backfill
+SNAPSHOT_CHANNEL_BACKFILL = 'raw_engagement_snapshots_channel_id_backfill'
+
+
+# --- Database Functions ---
+
+async def ensure_engagement_snapshots_table_exists():
+    """
+    Ensures the raw_engagement_snapshots table exists in the database.
+    A row is only appended when a message's counts change, so the table stays compact.
+    """
+    conn = None
+    try:
+        conn = get_db_connection()
+        cur = conn.cursor()
+        create_table_query = """
+        CREATE TABLE IF NOT EXISTS raw_engagement_snapshots (
+            message_id BIGINT NOT NULL,
+            captured_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT NOW(),
+            views_count INTEGER,
+            forwards_count INTEGER,
+            replies_count INTEGER,
+            PRIMARY KEY (message_id, captured_at)
+        );
+        -- Lets a channel's snapshots be read without going through every message
+        -- (rows written before the column existed are filled by backfill_snapshot_channel_ids)
+        ALTER TABLE raw_engagement_snapshots ADD COLUMN IF NOT EXISTS channel_id BIGINT;
+        CREATE INDEX IF NOT EXISTS idx_raw_engagement_snapshots_channel
+            ON raw_engagement_snapshots (channel_id, captured_at);
+        """
+        cur.execute(create_table_query)
+        conn.commit()
+        print("Ensured 'raw_engagement_snapshots' table exists.")
+    except Exception as e:
+        print(f"Error ensuring 'raw_engagement_snapshots' table exists: {e}")
+        if conn:
+            conn.rollback()
+        raise
+    finally:
+        if conn:
+            cur.close()
+            conn.close()
+
+
+async def backfill_snapshot_channel_ids():
+    """
+    One-time migration filling channel_id on snapshots written before the column existed.
+    Recorded in schema_migrations in the same transaction, so later starts only look up
+    the record instead of scanning the snapshots again.
+    """
+    conn = None
+    try:
+        conn = get_db_connection()
+        cur = conn.cursor()
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                name TEXT PRIMARY KEY,
+                applied_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT NOW()
+            );
+        """)
+        cur.execute("SELECT 1 FROM schema_migrations WHERE name = %s;", (SNAPSHOT_CHANNEL_BACKFILL,))
+        if cur.fetchone():
+            conn.commit()
+            return
+        cur.execute("""
+            UPDATE raw_engagement_snapshots snap
+            SET channel_id = rtm.channel_id
+            FROM raw_telegram_messages rtm
+            WHERE snap.channel_id IS NULL
+                AND rtm.message_id = snap.message_id;
+        """)
+        filled = cur.rowcount
+        cur.execute("""
+            INSERT INTO schema_migrations (name) VALUES (%s)
+            ON CONFLICT (name) DO NOTHING;
+        """, (SNAPSHOT_CHANNEL_BACKFILL,))
+        conn.commit()
+        print(f"Backfilled channel_id on {filled} engagement snapshot(s).")
+    except Exception as e:
+        print(f"Error backfilling engagement snapshot channel ids: {e}")
+        if conn:
+            conn.rollback()
+        raise
+    finally:
+        if conn:
+            cur.close()
+            conn.close()
+
+
+def get_recent_messages(days):
+    """Returns (channel_id, channel_username, message_id, views, forwards, replies) for messages of the last `days` days."""
+    conn = None
+    try:
+        conn = get_db_connection()
+        cur = conn.cursor()
+        cur.execute("""
+            SELECT
+                channel_id,
+                channel_username,
+                message_id,
+                views_count,
+                forwards_count,
+                (replies_count ->> 'replies')::INTEGER AS replies_count
+            FROM raw_telegram_messages
+            WHERE message_date >= NOW() - %s * INTERVAL '1 day'
+            ORDER BY channel_id, message_id;
+        """, (days,))
+        return cur.fetchall()
+    except Exception as e:
+        print(f"Error retrieving recent messages: {e}")
+        return []
+    finally:
+        if conn:
+            cur.close()
+            conn.close()
+
+
+def write_missing_baselines(days):
+    """
+    Records the stored counts of recent messages that have no snapshot yet, dated when they
+    were scraped. Messages scraped before snapshots existed otherwise start their history at
+    the first change, and the growth up to it would be missing from the engagement deltas.
+    Returns the number of baselines written.
+    """
+    conn = None
+    try:
+        conn = get_db_connection()
+        cur = conn.cursor()
+        cur.execute("""
+            INSERT INTO raw_engagement_snapshots (
+                message_id, channel_id, captured_at, views_count, forwards_count, replies_count
+            )
+            SELECT
+                rtm.message_id,
+                rtm.channel_id,
+                COALESCE(rtm.scraped_at, rtm.message_date, NOW()),
+                rtm.views_count,
+                rtm.forwards_count,
+                (rtm.replies_count ->> 'replies')::INTEGER
+            FROM raw_telegram_messages rtm
+            WHERE rtm.message_date >= NOW() - %s * INTERVAL '1 day'
+                AND NOT EXISTS (
+                    SELECT 1 FROM raw_engagement_snapshots snap
+                    WHERE snap.message_id = rtm.message_id
+                )
+            ON CONFLICT (message_id, captured_at) DO NOTHING;
+        """, (days,))
+        written = cur.rowcount
+        conn.commit()
+        return written
+    except Exception as e:
+        print(f"Error writing baseline engagement snapshots: {e}")
+        if conn:
+            conn.rollback()
+        return 0
+    finally:
+        if conn:
+            cur.close()
+            conn.close()
+
+
+def write_engagement_changes(channel_id, changes, captured_at):
+    """
+    Appends a snapshot for every changed message of a channel and updates the latest
+    counts on raw_telegram_messages, each in a single batched statement.
+    `changes` is a list of (message_id, views, forwards, replies, replies_json).
+    """
+    if not changes:
+        return
+
+    conn = None
+    try:
+        conn = get_db_connection()
+        cur = conn.cursor()
+        execute_values(cur, """
+            INSERT INTO raw_engagement_snapshots (
+                message_id, channel_id, captured_at, views_count, forwards_count, replies_count
+            ) VALUES %s
+            ON CONFLICT (message_id, captured_at) DO NOTHING;
+        """, [
+            (message_id, channel_id, captured_at, views, forwards, replies)
+            for message_id, views, forwards, replies, _ in changes
+        ])
+        execute_values(cur, """
+            UPDATE raw_telegram_messages AS rtm
+            SET
+                views_count = COALESCE(v.views_count, rtm.views_count),
+                forwards_count = COALESCE(v.forwards_count, rtm.forwards_count),
+                replies_count = COALESCE(v.replies_count, rtm.replies_count)
+            FROM (VALUES %s) AS v(message_id, views_count, forwards_count, replies_count)
+            WHERE rtm.message_id = v.message_id;
+        """, [
+            (message_id, views, forwards, replies_json)
+            for message_id, views, forwards, _, replies_json in changes
+        ], template="(%s::BIGINT, %s::BIGINT, %s::BIGINT, %s::JSONB)")
+        conn.commit()
+    except Exception as e:
+        print(f"Error writing engagement changes: {e}")
+        if conn:
+            conn.rollback()
+    finally:
+        if conn:
+            cur.close()
+            conn.close()
+
+
+# --- Refresh Logic ---
+
+async def fetch_message_views(client, peer, message_ids):
+    """Fetches current view, forward and reply counts for up to 100 messages of one channel."""
+    result = await client(functions.messages.GetMessagesViewsRequest(
+        peer=peer,
+        id=message_ids,
+        increment=False  # Do not count this request as a view
+    ))
+    return zip(message_ids, result.views)
+
+
+async def refresh_engagement_metrics(client, days=ENGAGEMENT_REFRESH_DAYS):
+    """
+    Re-polls engagement counts for every message posted in the last `days` days
+    and records the ones that changed. Returns the number of changed messages.
+    """
+    # Database helpers run in a worker thread so the scraper's event loop keeps serving
+    # new messages and media downloads during a refresh
+    rows = await asyncio.to_thread(get_recent_messages, days)
+    if not rows:
+        print(f"No messages from the last {days} day(s) to refresh.")
+        return 0
+
+    baselines = await asyncio.to_thread(write_missing_baselines, days)
+    if baselines:
+        print(f"Recorded baseline engagement snapshots for {baselines} message(s) without history.")
+
+    total_changed = 0
+    captured_at = datetime.now(timezone.utc)
+
+    for (channel_id, channel_username), channel_rows in itertools.groupby(rows, key=lambda r: (r[0], r[1])):
+        channel_rows = list(channel_rows)
+        current = {row[2]: row[3:] for row in channel_rows}
+        try:
+            peer = await client.get_input_entity(channel_username or PeerChannel(channel_id))
+        except Exception as e:
+            print(f"Error resolving channel {channel_username or channel_id}: {e}")
+            continue
+
+        changes = []
+        message_ids = list(current)
+        for start in range(0, len(message_ids), VIEWS_BATCH_SIZE):
+            batch = message_ids[start:start + VIEWS_BATCH_SIZE]
+            try:
+                views = await fetch_message_views(client, peer, batch)
+            except Exception as e:
+                print(f"Error fetching views for channel {channel_username or channel_id}: {e}")
+                continue
+
+            for message_id, message_views in views:
+                fetched_counts = (
+                    message_views.views,
+                    message_views.forwards,
+                    message_views.replies.replies if message_views.replies else None,
+                )
+                # Telegram omits counts it does not track; keep the stored value for those
+                new_counts = tuple(
+                    old if new is None else new
+                    for new, old in zip(fetched_counts, current[message_id])
+                )
+                if new_counts == tuple(current[message_id]):
+                    continue
+                replies_json = message_views.replies.to_json() if message_views.replies else None
+                changes.append((message_id, *new_counts, replies_json))
+
+        await asyncio.to_thread(write_engagement_changes, channel_id, changes, captured_at)
+        total_changed += len(changes)
+        print(f"Refreshed engagement for channel {channel_username or channel_id}: "
+              f"{len(changes)} of {len(message_ids)} message(s) changed.")
+
+    return total_changed
+
+
+async def run_periodic_refresh(client, interval=ENGAGEMENT_REFRESH_INTERVAL, days=ENGAGEMENT_REFRESH_DAYS):
+    """Refreshes engagement metrics every `interval` seconds until cancelled."""
+    while True:
+        try:
+            await refresh_engagement_metrics(client, days)
+        except Exception as e:
+            print(f"Error refreshing engagement metrics: {e}")
+        await asyncio.sleep(interval)
+
+
+async def main():
+    api_id = os.getenv('API_ID')
+    api_hash = os.getenv('API_HASH')
+
+    await ensure_engagement_snapshots_table_exists()
+    await backfill_snapshot_channel_ids()
+
+    client = TelegramClient('anon', api_id, api_hash)
+    await client.start(phone=os.getenv('PHONE_NUMBER'))
+    try:
+        changed = await refresh_engagement_metrics(client)
+        print(f"Engagement refresh finished: {changed} message(s) updated.")
+    finally:
+        await client.disconnect()
+
+
+if __name__ == '__main__':
+
+    if not all([os.getenv('API_ID'), os.getenv('API_HASH'), os.getenv('PHONE_NUMBER'), DB_NAME, DB_USER, DB_PASSWORD]):
+        print("Error: Missing required environment variables. Please check your .env file.")
+        print("Required: API_ID, API_HASH, PHONE_NUMBER, DB_NAME, DB_USER, DB_PASSWORD")
+    else:
+        asyncio.run(main())
@@ -0,0 +1,508 @@
+import os
+import asyncio
+import itertools
+import json
+import time
+from telethon import utils as telethon_utils
+from telethon.tl.types import MessageMediaPhoto, MessageMediaDocument, PeerChannel
+
+from utils import get_db_connection
+
+# --- Media Download Policy Configuration ---
+# Comma separated list of media types to fetch: photo, video, document
+MEDIA_ALLOWED_TYPES = {
+    t.strip() for t in os.getenv('MEDIA_ALLOWED_TYPES', 'photo,video,document').split(',') if t.strip()
+}
+
+# Per-type size caps in bytes. Files above the cap are recorded as skipped.
+MEDIA_MAX_BYTES = {
+    'photo': int(os.getenv('MEDIA_MAX_PHOTO_BYTES', 20 * 1024 * 1024)),
+    'video': int(os.getenv('MEDIA_MAX_VIDEO_BYTES', 200 * 1024 * 1024)),
+    'document': int(os.getenv('MEDIA_MAX_DOCUMENT_BYTES', 50 * 1024 * 1024)),
+}
+
+# Total download bandwidth shared by all workers, in bytes per second (0 = unlimited)
+MEDIA_BANDWIDTH_LIMIT = int(os.getenv('MEDIA_BANDWIDTH_LIMIT', 0))
+MEDIA_DOWNLOAD_WORKERS = int(os.getenv('MEDIA_DOWNLOAD_WORKERS', 4))
+# Maximum number of downloads waiting in memory. Media arriving while the queue is full stays
+# 'pending' in raw_media_downloads and is loaded back by the workers once the queue drains.
+MEDIA_QUEUE_MAX_SIZE = int(os.getenv('MEDIA_QUEUE_MAX_SIZE', 1000))
+# messages.getMessages accepts at most 100 ids per call
+MEDIA_REFETCH_BATCH_SIZE = 100
+# Seconds a re-fetched message is used for before it is fetched again for a fresh file reference
+MEDIA_MESSAGE_CACHE_TTL = int(os.getenv('MEDIA_MESSAGE_CACHE_TTL', 1800))
+
+# Number of frames sampled from each video for YOLO
+VIDEO_KEYFRAME_COUNT = int(os.getenv('VIDEO_KEYFRAME_COUNT', 5))
+
+# Lower value is downloaded first
+MEDIA_TYPE_PRIORITY = {
+    'photo': 0,
+    'document': 1,
+    'video': 2,
+}
+
+
+# --- Database Functions ---
+
+async def ensure_media_downloads_table_exists():
+    """
+    Ensures the raw_media_downloads table exists in the database.
+    This table tracks the download state of every message's media.
+    """
+    conn = None
+    try:
+        conn = get_db_connection()
+        cur = conn.cursor()
+        create_table_query = """
+        CREATE TABLE IF NOT EXISTS raw_media_downloads (
+            id SERIAL PRIMARY KEY,
+            message_id BIGINT UNIQUE NOT NULL,
+            channel_id BIGINT NOT NULL,
+            channel_username TEXT,
+            media_type TEXT NOT NULL, -- photo | video | document
+            mime_type TEXT,
+            file_size BIGINT,
+            status TEXT NOT NULL DEFAULT 'pending', -- pending | downloaded | skipped | failed
+            local_media_path TEXT,
+            keyframe_paths JSONB, -- Sampled frames for videos, passed to YOLO instead of the video
+            error TEXT,
+            enqueued_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+            downloaded_at TIMESTAMP WITH TIME ZONE
+        );
+        CREATE INDEX IF NOT EXISTS idx_raw_media_downloads_status
+            ON raw_media_downloads (status);
+        """
+        cur.execute(create_table_query)
+        conn.commit()
+        print("Ensured 'raw_media_downloads' table exists.")
+    except Exception as e:
+        print(f"Error ensuring 'raw_media_downloads' table exists: {e}")
+        if conn:
+            conn.rollback()
+        raise
+    finally:
+        if conn:
+            cur.close()
+            conn.close()
+
+
+def record_pending_media(message_id, channel_id, channel_username, media_type, mime_type, file_size, status, error=None):
+    """
+    Inserts the media record for a message and returns its current status.
+    An existing record keeps its status, so re-scraped messages are not downloaded twice,
+    except failed downloads which go back to the queue.
+    """
+    conn = None
+    try:
+        conn = get_db_connection()
+        cur = conn.cursor()
+        cur.execute("""
+            INSERT INTO raw_media_downloads (
+                message_id, channel_id, channel_username, media_type, mime_type, file_size, status, error
+            ) VALUES (
+                %s, %s, %s, %s, %s, %s, %s, %s
+            ) ON CONFLICT (message_id) DO UPDATE SET
+                file_size = EXCLUDED.file_size,
+                status = CASE
+                    WHEN raw_media_downloads.status = 'failed' THEN EXCLUDED.status
+                    ELSE raw_media_downloads.status
+                END
+            RETURNING status;
+        """, (message_id, channel_id, channel_username, media_type, mime_type, file_size, status, error))
+        current_status = cur.fetchone()[0]
+        conn.commit()
+        return current_status
+    except Exception as e:
+        print(f"Error recording media for message {message_id}: {e}")
+        if conn:
+            conn.rollback()
+        return None
+    finally:
+        if conn:
+            cur.close()
+            conn.close()
+
+
+def get_pending_media(exclude_ids, limit):
+    """
+    Returns (message_id, channel_id, channel_username, media_type, message_date) of pending
+    downloads not in `exclude_ids`, photos first and newest first within each media type.
+    """
+    conn = None
+    try:
+        conn = get_db_connection()
+        cur = conn.cursor()
+        cur.execute("""
+            SELECT
+                rmd.message_id,
+                rmd.channel_id,
+                rmd.channel_username,
+                rmd.media_type,
+                rtm.message_date
+            FROM raw_media_downloads rmd
+            LEFT JOIN raw_telegram_messages rtm ON rtm.message_id = rmd.message_id
+            WHERE rmd.status = 'pending'
+                AND NOT (rmd.message_id = ANY(%s))
+            ORDER BY
+                COALESCE((%s::JSONB ->> rmd.media_type)::INTEGER, %s),
+                rtm.message_date DESC NULLS LAST
+            LIMIT %s;
+        """, (list(exclude_ids), json.dumps(MEDIA_TYPE_PRIORITY), len(MEDIA_TYPE_PRIORITY), limit))
+        return cur.fetchall()
+    except Exception as e:
+        print(f"Error retrieving pending media downloads: {e}")
+        return []
+    finally:
+        if conn:
+            cur.close()
+            conn.close()
+
+
+def mark_media_downloaded(message_id, local_media_path, keyframe_paths=None):
+    """Marks a media record as downloaded and fills in the message's local_media_path."""
+    conn = None
+    try:
+        conn = get_db_connection()
+        cur = conn.cursor()
+        cur.execute("""
+            UPDATE raw_media_downloads
+            SET status = 'downloaded',
+                local_media_path = %s,
+                keyframe_paths = %s,
+                error = NULL,
+                downloaded_at = NOW()
+            WHERE message_id = %s;
+        """, (local_media_path, json.dumps(keyframe_paths) if keyframe_paths is not None else None, message_id))
+        cur.execute("""
+            UPDATE raw_telegram_messages
+            SET local_media_path = %s
+            WHERE message_id = %s;
+        """, (local_media_path, message_id))
+        conn.commit()
+    except Exception as e:
+        print(f"Error marking media downloaded for message {message_id}: {e}")
+        if conn:
+            conn.rollback()
+    finally:
+        if conn:
+            cur.close()
+            conn.close()
+
+
+def mark_media_failed(message_id, error):
+    """Records a failed download so it can be inspected or retried on the next scrape."""
+    conn = None
+    try:
+        conn = get_db_connection()
+        cur = conn.cursor()
+        cur.execute("""
+            UPDATE raw_media_downloads
+            SET status = 'failed', error = %s
+            WHERE message_id = %s;
+        """, (str(error), message_id))
+        conn.commit()
+    except Exception as e:
+        print(f"Error marking media failed for message {message_id}: {e}")
+        if conn:
+            conn.rollback()
+    finally:
+        if conn:
+            cur.close()
+            conn.close()
+
+
+# --- Media Helpers ---
+
+def _largest_photo_size(photo):
+    """Returns the byte size of the largest available size of a Telegram photo."""
+    largest = 0
+    for size in getattr(photo, 'sizes', None) or []:
+        if getattr(size, 'sizes', None):  # PhotoSizeProgressive
+            largest = max(largest, max(size.sizes))
+        elif getattr(size, 'size', None):
+            largest = max(largest, size.size)
+    return largest
+
+
+def classify_media(media):
+    """
+    Returns (media_type, mime_type, file_size) for a Telethon media object,
+    or None if the media has no downloadable file (web page previews, polls, ...).
+    """
+    if isinstance(media, MessageMediaPhoto) and media.photo:
+        return 'photo', 'image/jpeg', _largest_photo_size(media.photo)
+
+    if isinstance(media, MessageMediaDocument) and media.document:
+        mime_type = media.document.mime_type or ''
+        if mime_type.startswith('video/'):
+            media_type = 'video'
+        elif mime_type.startswith('image/'):
+            media_type = 'photo'
+        else:
+            media_type = 'document'
+        return media_type, mime_type, media.document.size
+
+    return None
+
+
+def skip_reason(media_type, file_size):
+    """Returns why a file should not be downloaded under the current policy, or None."""
+    if media_type not in MEDIA_ALLOWED_TYPES:
+        return f"media type '{media_type}' not in MEDIA_ALLOWED_TYPES"
+    max_bytes = MEDIA_MAX_BYTES.get(media_type)
+    if max_bytes and file_size and file_size > max_bytes:
+        return f"file size {file_size} exceeds {media_type} limit of {max_bytes} bytes"
+    return None
+
+
+def extract_keyframes(video_path, frame_count=VIDEO_KEYFRAME_COUNT):
+    """
+    Samples `frame_count` evenly spaced frames from a video and saves them as JPEGs
+    in a `<video>_keyframes` directory next to it. Returns the list of frame paths.
+    """
+    # Imported here so the scraper only needs OpenCV when videos are downloaded
+    import cv2
+
+    capture = cv2.VideoCapture(video_path)
+    if not capture.isOpened():
+        raise ValueError(f"Could not open video {video_path}")
+
+    try:
+        total_frames = int(capture.get(cv2.CAP_PROP_FRAME_COUNT))
+        if total_frames <= 0:
+            return []
+
+        frames_dir = os.path.splitext(video_path)[0] + '_keyframes'
+        os.makedirs(frames_dir, exist_ok=True)
+
+        count = min(frame_count, total_frames)
+        # Take the middle frame of each segment so intro/outro frames are skipped
+        frame_indices = [int((i + 0.5) * total_frames / count) for i in range(count)]
+
+        keyframe_paths = []
+        for frame_index in frame_indices:
+            capture.set(cv2.CAP_PROP_POS_FRAMES, frame_index)
+            ok, frame = capture.read()
+            if not ok:
+                continue
+            frame_path = os.path.join(frames_dir, f"frame_{frame_index:06d}.jpg")
+            cv2.imwrite(frame_path, frame)
+            keyframe_paths.append(frame_path)
+        return keyframe_paths
+    finally:
+        capture.release()
+
+
+class BandwidthLimiter:
+    """Token bucket shared by all download workers. A rate of 0 disables throttling."""
+
+    def __init__(self, bytes_per_second):
+        self.rate = bytes_per_second
+        self._allowance = bytes_per_second
+        self._last_check = time.monotonic()
+        self._lock = None  # Created lazily so it binds to the running event loop
+
+    async def consume(self, nbytes):
+        if self.rate <= 0:
+            return
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            now = time.monotonic()
+            self._allowance = min(self.rate, self._allowance + (now - self._last_check) * self.rate)
+            self._last_check = now
+            self._allowance -= nbytes
+            if self._allowance < 0:
+                await asyncio.sleep(-self._allowance / self.rate)
+
+
+# --- Download Queue ---
+
+class MediaDownloadQueue:
+    """
+    Priority queue of pending media downloads drained by a pool of async workers.
+    Photos are downloaded before documents and videos, and newer messages before older ones.
+
+    The queue only holds message ids, up to MEDIA_QUEUE_MAX_SIZE of them; enqueue() never waits.
+    Media that does not fit stays 'pending' in raw_media_downloads, and the workers load it
+    back in priority order once the queue is half empty. Messages are fetched again right
+    before their download, in batches of up to 100 per channel, so file references are fresh.
+    """
+
+    def __init__(self, base_path, workers=MEDIA_DOWNLOAD_WORKERS, bandwidth_limit=MEDIA_BANDWIDTH_LIMIT,
+                 max_size=MEDIA_QUEUE_MAX_SIZE):
+        self.base_path = base_path
+        self.workers = workers
+        self.max_size = max_size
+        self.limiter = BandwidthLimiter(bandwidth_limit)
+        self._client = None
+        self._queue = None  # Created in start() so it binds to the running event loop
+        self._counter = itertools.count()  # Tie-breaker so queue entries are never compared past the priority
+        self._queued = {}  # message_id -> channel_id of entries waiting in the queue
+        self._active = set()  # message_ids being downloaded
+        self._channels = {}  # channel_id -> [input peer or None, username]
+        self._fetched = {}  # message_id -> (fetched_at, Message) re-fetched for queued entries
+        self._fetch_lock = None
+        self._refill_lock = None
+        # Pending rows may be left in the database, by earlier runs or while the queue was full
+        self._backlog = True
+        self._tasks = []
+
+    def start(self, client):
+        """Starts the download workers on the running event loop."""
+        self._client = client
+        self._queue = asyncio.PriorityQueue()
+        self._fetch_lock = asyncio.Lock()
+        self._refill_lock = asyncio.Lock()
+        for worker_id in range(self.workers):
+            self._tasks.append(asyncio.create_task(self._worker(worker_id)))
+        print(f"Started {self.workers} media download worker(s).")
+
+    async def stop(self):
+        """Cancels the download workers. Pending records stay 'pending' and are picked up on the next start."""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def join(self):
+        """Waits until every queued download has been processed."""
+        await self._queue.join()
+
+    def _put(self, message_id, channel_id, media_type, message_date):
+        timestamp = message_date.timestamp() if message_date else 0
+        priority = (MEDIA_TYPE_PRIORITY.get(media_type, len(MEDIA_TYPE_PRIORITY)), -timestamp)
+        self._queued[message_id] = channel_id
+        self._queue.put_nowait((priority, next(self._counter), message_id, channel_id, media_type))
+
+    async def enqueue(self, message, chat):
+        """
+        Records a pending media row for the message and queues it for download if allowed by
+        the policy. Never waits: when the queue is full the row is left pending in the database.
+        """
+        media_info = classify_media(message.media)
+        if media_info is None:
+            return
+        media_type, mime_type, file_size = media_info
+
+        reason = skip_reason(media_type, file_size)
+        status = await asyncio.to_thread(
+            record_pending_media,
+            message.id, chat.id, getattr(chat, 'username', None),
+            media_type, mime_type, file_size,
+            'skipped' if reason else 'pending', reason
+        )
+        if reason:
+            print(f"Skipping media for message {message.id}: {reason}")
+            return
+        if status != 'pending' or message.id in self._queued or message.id in self._active:
+            return
+
+        if chat.id not in self._channels:
+            self._channels[chat.id] = [telethon_utils.get_input_peer(chat), getattr(chat, 'username', None)]
+        if self._queue.qsize() >= self.max_size:
+            self._backlog = True
+            return
+        self._put(message.id, chat.id, media_type, message.date)
+
+    async def _refill(self):
+        """Loads pending downloads from the database into the queue, highest priority first."""
+        async with self._refill_lock:
+            free = self.max_size - self._queue.qsize()
+            if not self._backlog or free < self.max_size // 2:
+                return
+            self._backlog = False
+            rows = await asyncio.to_thread(
+                get_pending_media, set(self._queued) | self._active, free
+            )
+            if len(rows) == free:
+                self._backlog = True  # There may be more than fits
+            for message_id, channel_id, channel_username, media_type, message_date in rows:
+                if message_id in self._queued or message_id in self._active:
+                    continue
+                self._channels.setdefault(channel_id, [None, channel_username])
+                self._put(message_id, channel_id, media_type, message_date)
+            if rows:
+                print(f"Loaded {len(rows)} pending media download(s) from the database.")
+
+    async def _worker(self, worker_id):
+        while True:
+            if self._backlog:
+                await self._refill()
+            _, _, message_id, channel_id, media_type = await self._queue.get()
+            self._queued.pop(message_id, None)
+            self._active.add(message_id)
+            try:
+                await self._download(message_id, channel_id, media_type)
+            except Exception as e:
+                print(f"Error downloading media for message {message_id}: {e}")
+                await asyncio.to_thread(mark_media_failed, message_id, e)
+            finally:
+                self._active.discard(message_id)
+                self._fetched.pop(message_id, None)
+                self._queue.task_done()
+
+    async def _get_message(self, message_id, channel_id):
+        """
+        Returns the current Message for a queued download. On a cache miss the message is
+        fetched together with up to 99 other queued messages of the same channel.
+        """
+        async with self._fetch_lock:
+            fetched_at = time.monotonic()
+            cached = self._fetched.pop(message_id, None)
+            if cached and fetched_at - cached[0] < MEDIA_MESSAGE_CACHE_TTL:
+                return cached[1]
+
+            channel = self._channels[channel_id]
+            if channel[0] is None:
+                channel[0] = await self._client.get_input_entity(channel[1] or PeerChannel(channel_id))
+
+            batch = [message_id] + [
+                queued_id for queued_id, queued_channel in self._queued.items()
+                if queued_channel == channel_id
+                and fetched_at - self._fetched.get(queued_id, (float('-inf'),))[0] >= MEDIA_MESSAGE_CACHE_TTL
+            ][:MEDIA_REFETCH_BATCH_SIZE - 1]
+            messages = await self._client.get_messages(channel[0], ids=batch)
+
+            for batch_id, message in zip(batch, messages):
+                if message is not None:
+                    self._fetched[batch_id] = (fetched_at, message)
+            cached = self._fetched.pop(message_id, None)
+            return cached[1] if cached else None
+
+    def _progress_callback(self):
+        last_received = 0
+
+        async def callback(received, total):
+            nonlocal last_received
+            await self.limiter.consume(received - last_received)
+            last_received = received
+
+        return callback
+
+    async def _download(self, message_id, channel_id, media_type):
+        message = await self._get_message(message_id, channel_id)
+        if message is None or message.media is None:
+            raise ValueError("message or its media no longer exists")
+
+        channel_dir_name = self._channels[channel_id][1] or str(channel_id)
+        channel_media_path = os.path.join(self.base_path, channel_dir_name)
+        os.makedirs(channel_media_path, exist_ok=True)
+
+        print(f"Downloading {media_type} for message {message_id} from channel {channel_dir_name}...")
+        file_path = await message.download_media(
+            file=channel_media_path,
+            progress_callback=self._progress_callback()
+        )
+        if file_path is None:
+            raise ValueError("download_media returned no file")
+        local_media_path = str(file_path)
+
+        keyframe_paths = None
+        if media_type == 'video':
+            keyframe_paths = await asyncio.to_thread(extract_keyframes, local_media_path)
+            print(f"Extracted {len(keyframe_paths)} keyframe(s) from {local_media_path}")
+
+        await asyncio.to_thread(mark_media_downloaded, message_id, local_media_path, keyframe_paths)
+        print(f"Media saved to: {local_media_path}")
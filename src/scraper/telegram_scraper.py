@@ -5,17 +5,15 @@ from telethon.tl.types import MessageMediaPhoto, MessageMediaDocument
 import psycopg2
 from psycopg2 import sql
 from dotenv import load_dotenv
-import time
 
-load_dotenv()
+from utils import get_db_connection, DB_HOST, DB_NAME, DB_USER, DB_PASSWORD
+from media_downloader import MediaDownloadQueue, ensure_media_downloads_table_exists
+from engagement_refresher import (
+    ENGAGEMENT_REFRESH_INTERVAL, ensure_engagement_snapshots_table_exists, backfill_snapshot_channel_ids,
+    run_periodic_refresh
+)
 
-# --- Database Configuration ---
-DB_HOST = os.getenv('DB_HOST', 'db') 
-# DB_HOST = 'localhost' 
-DB_NAME = os.getenv('DB_NAME')
-DB_USER = os.getenv('DB_USER')
-DB_PASSWORD = os.getenv('DB_PASSWORD')
-DB_PORT = os.getenv('DB_PORT', '5432')
+load_dotenv()
 
 print(f"DEBUG: Scraper attempting to connect to DB_HOST: {DB_HOST}")
 
@@ -32,43 +30,16 @@ TARGET_CHANNELS = [
 
 # --- Media Download Path ---
 
-MEDIA_DOWNLOAD_BASE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '../../data/raw/telegram_media')
+MEDIA_DOWNLOAD_BASE_PATH = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../../data/raw/telegram_media'))
 os.makedirs(MEDIA_DOWNLOAD_BASE_PATH, exist_ok=True) 
 
 # --- Telegram Client Initialization ---
 client = TelegramClient('anon', API_ID, API_HASH)
 
-# --- Database Functions ---
-
-def get_db_connection(retries=5, delay=3):
-    """
-    Establishes and returns a database connection with retries.
-    """
-    if not all([DB_NAME, DB_USER, DB_PASSWORD, DB_HOST, DB_PORT]):
-        raise ValueError("Missing one or more database environment variables. Check your .env file.")
-
-    for i in range(retries):
-        try:
-            conn = psycopg2.connect(
-                host=DB_HOST,
-                database=DB_NAME,
-                user=DB_USER,
-                password=DB_PASSWORD,
-                port=DB_PORT
-            )
-            print(f"Database connection successful after {i+1} attempt(s).")
-            return conn
-        except psycopg2.OperationalError as e:
-            if "could not translate host name" in str(e) or "Is the server running on host" in str(e):
-                print(f"Attempt {i+1}/{retries}: Database not ready yet ({e}). Retrying in {delay} seconds...")
-                time.sleep(delay)
-            else:
-                raise e
-        except Exception as e:
-            raise e
-
-    raise Exception(f"Failed to connect to database after {retries} attempts.")
+# --- Media Download Queue ---
+media_queue = MediaDownloadQueue(MEDIA_DOWNLOAD_BASE_PATH)
 
+# --- Database Functions ---
 
 async def ensure_raw_messages_table_exists():
     """
@@ -98,6 +69,9 @@ async def ensure_raw_messages_table_exists():
             local_media_path TEXT, -- New column to store local path to saved media
             scraped_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
         );
+        -- The engagement refresher selects recent messages by date
+        CREATE INDEX IF NOT EXISTS idx_raw_telegram_messages_message_date
+            ON raw_telegram_messages (message_date);
         """
         cur.execute(create_table_query)
         conn.commit()
@@ -127,7 +101,8 @@ async def insert_message_to_db(message_data):
                 replies_count, reactions_count, link, media_data, local_media_path
             ) VALUES (
                 %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s
-            ) ON CONFLICT (message_id) DO NOTHING;
+            ) ON CONFLICT (message_id) DO NOTHING
+            RETURNING message_id;
         """)
         cur.execute(insert_query, (
             message_data['message_id'], message_data['channel_id'], message_data['channel_username'],
@@ -136,6 +111,19 @@ async def insert_message_to_db(message_data):
             message_data['replies_count'], message_data['reactions_count'], message_data['link'],
             message_data['media_data'], message_data['local_media_path'] 
         ))
+
+        # First time we see the message: record its counts as the start of its engagement curve
+        if cur.fetchone():
+            cur.execute("""
+                INSERT INTO raw_engagement_snapshots (
+                    message_id, channel_id, views_count, forwards_count, replies_count
+                ) VALUES (
+                    %s, %s, %s, %s, %s
+                ) ON CONFLICT DO NOTHING;
+            """, (
+                message_data['message_id'], message_data['channel_id'], message_data['views_count'],
+                message_data['forwards_count'], message_data['replies']
+            ))
         conn.commit()
 
     except Exception as e:
@@ -154,25 +142,6 @@ async def my_event_handler(event):
     message = event.message
     chat = await event.get_chat()
 
-    local_media_path = None 
-
-    if message.media:
-
-        channel_dir_name = chat.username if chat.username else str(chat.id)
-        channel_media_path = os.path.join(MEDIA_DOWNLOAD_BASE_PATH, channel_dir_name)
-        os.makedirs(channel_media_path, exist_ok=True) 
-
-        try:
-            
-            print(f"Downloading media for message {message.id} from channel {channel_dir_name}...")
-
-            file_path = await message.download_media(file=channel_media_path)
-            local_media_path = str(file_path) 
-            print(f"Media saved to: {local_media_path}")
-        except Exception as e:
-            print(f"Error downloading media for message {message.id}: {e}")
-            local_media_path = None 
-
     # Extract relevant message data
     message_data = {
         'message_id': message.id,
@@ -184,21 +153,32 @@ async def my_event_handler(event):
         'sender_username': message.sender.username if message.sender and hasattr(message.sender, 'username') else None,
         'views_count': message.views,
         'forwards_count': message.forwards,
-        'replies_count': message.repllies.to_json() if message.replies else None,
+        'replies_count': message.replies.to_json() if message.replies else None,
+        'replies': message.replies.replies if message.replies else None,
         'reactions_count': message.reactions.to_json() if message.reactions else None,
         'link': f"https://t.me/{chat.username}/{message.id}" if chat.username else None,
         'media_data': message.media.to_json() if message.media else None,
-        'local_media_path': local_media_path 
+        'local_media_path': None # Filled in by the media download workers
     }
 
     await insert_message_to_db(message_data)
 
+    # The message row is written first; media is fetched in the background
+    if message.media:
+        await media_queue.enqueue(message, chat)
+
     print(f"Scraped & Inserted: Channel {message_data['channel_username']} - Message {message_data['message_id']}")
 
 
 async def main():
 
     await ensure_raw_messages_table_exists()
+    await ensure_media_downloads_table_exists()
+    await ensure_engagement_snapshots_table_exists()
+    await backfill_snapshot_channel_ids()
+
+    # Start the download workers before any message handler can enqueue media
+    media_queue.start(client)
 
     # Connect to Telegram
     print("Connecting to Telegram...")
@@ -219,8 +199,17 @@ async def main():
             print(f"Error fetching past messages for {channel_entity}: {e}")
 
 
+    refresh_task = None
+    if ENGAGEMENT_REFRESH_INTERVAL > 0:
+        refresh_task = asyncio.create_task(run_periodic_refresh(client))
+
     print("Listening for new messages (Press Ctrl+C to stop)...")
-    await client.run_until_disconnected()
+    try:
+        await client.run_until_disconnected()
+    finally:
+        if refresh_task:
+            refresh_task.cancel()
+        await media_queue.stop()
 
 
 if __name__ == '__main__':
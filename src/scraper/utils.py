@@ -1 +1,46 @@
-# Utility functions for scraper
\ No newline at end of file
+# Utility functions for scraper
+
+import os
+import time
+import psycopg2
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# --- Database Configuration ---
+DB_HOST = os.getenv('DB_HOST', 'db')
+# DB_HOST = 'localhost'
+DB_NAME = os.getenv('DB_NAME')
+DB_USER = os.getenv('DB_USER')
+DB_PASSWORD = os.getenv('DB_PASSWORD')
+DB_PORT = os.getenv('DB_PORT', '5432')
+
+
+def get_db_connection(retries=5, delay=3):
+    """
+    Establishes and returns a database connection with retries.
+    """
+    if not all([DB_NAME, DB_USER, DB_PASSWORD, DB_HOST, DB_PORT]):
+        raise ValueError("Missing one or more database environment variables. Check your .env file.")
+
+    for i in range(retries):
+        try:
+            conn = psycopg2.connect(
+                host=DB_HOST,
+                database=DB_NAME,
+                user=DB_USER,
+                password=DB_PASSWORD,
+                port=DB_PORT
+            )
+            print(f"Database connection successful after {i+1} attempt(s).")
+            return conn
+        except psycopg2.OperationalError as e:
+            if "could not translate host name" in str(e) or "Is the server running on host" in str(e):
+                print(f"Attempt {i+1}/{retries}: Database not ready yet ({e}). Retrying in {delay} seconds...")
+                time.sleep(delay)
+            else:
+                raise e
+        except Exception as e:
+            raise e
+
+    raise Exception(f"Failed to connect to database after {retries} attempts.")
@@ -0,0 +1,209 @@
+import os
+import re
+import pickle
+from collections import defaultdict
+from itertools import combinations
+from PIL import Image
+
+# --- Perceptual Hash Configuration ---
+MEDIA_ROOT = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../../data/raw/telegram_media'))
+HASH_INDEX_PATH = os.getenv(
+    'IMAGE_HASH_INDEX_PATH',
+    os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../../data/processed/image_hash_index.pkl'))
+)
+# Images whose 64-bit dHashes differ in at most this many bits are treated as the same image.
+# Up to 5 bits a lookup probes 1-bit neighbourhoods only; larger values work but query slower.
+HAMMING_THRESHOLD = int(os.getenv('IMAGE_HAMMING_THRESHOLD', 5))
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp', '.bmp')
+
+HASH_BITS = 64
+
+
+def dhash(image_path, hash_size=8):
+    """
+    Computes the 64-bit difference hash of an image: the image is shrunk to
+    9x8 grayscale and each bit records whether a pixel is brighter than its right neighbour.
+    Robust to recompression, resizing and small overlays such as captions.
+    """
+    with Image.open(image_path) as img:
+        img.draft('L', (hash_size * 4, hash_size * 4))  # Lets JPEGs decode at a reduced scale
+        pixels = list(img.convert('L').resize((hash_size + 1, hash_size), Image.LANCZOS).getdata())
+
+    value = 0
+    for row in range(hash_size):
+        offset = row * (hash_size + 1)
+        for col in range(hash_size):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return value
+
+
+def media_key(image_path):
+    """Returns the path of a media file relative to telegram_media, as the dbt `media_key` macro does."""
+    path = image_path.replace('\\', '/')
+    match = re.search(r'telegram_media/(.*)$', path)
+    return match.group(1) if match else path
+
+
+def image_size(image_path):
+    """Returns the (width, height) of an image in pixels without decoding it."""
+    with Image.open(image_path) as img:
+        return img.size
+
+
+def hamming_distance(a, b):
+    return bin(a ^ b).count('1')
+
+
+def to_signed_64(value):
+    """Converts an unsigned 64-bit hash to the signed range of a Postgres BIGINT."""
+    return value - (1 << 64) if value >= (1 << 63) else value
+
+
+class ImageHashIndex:
+    """
+    Multi-index hash over 64-bit perceptual hashes.
+
+    Each hash is split into `chunks` substrings, each with its own bucket table. Two hashes
+    within `threshold` bits must agree to within `threshold // chunks` bits on at least one
+    substring (pigeonhole principle), so a lookup only probes the buckets of nearby substring
+    values instead of scanning every stored hash.
+    """
+
+    def __init__(self, threshold=HAMMING_THRESHOLD, chunks=3):
+        self.threshold = threshold
+        self.chunks = chunks
+        # Substrings of ~21 bits keep buckets near one entry each at millions of images
+        self.chunk_widths = [HASH_BITS // chunks + (1 if i < HASH_BITS % chunks else 0) for i in range(chunks)]
+        self.chunk_offsets = [sum(self.chunk_widths[:i]) for i in range(chunks)]
+        self.radius = threshold // chunks
+        # XOR masks of every substring value within `radius` bits, per substring width
+        self._probe_masks = [
+            [0] + [
+                sum(1 << bit for bit in bits)
+                for r in range(1, self.radius + 1)
+                for bits in combinations(range(width), r)
+            ]
+            for width in self.chunk_widths
+        ]
+
+        self.entries = {}  # image_path -> (hash, cluster_id)
+        self._clusters_by_key = {}  # media_key -> cluster_id
+        self._paths = []
+        self._hashes = []
+        self._buckets = [defaultdict(list) for _ in range(chunks)]
+        self._next_cluster_id = 1
+
+    def __len__(self):
+        return len(self._paths)
+
+    def __contains__(self, image_path):
+        return image_path in self.entries
+
+    def _substrings(self, value):
+        return [
+            (value >> offset) & ((1 << width) - 1)
+            for offset, width in zip(self.chunk_offsets, self.chunk_widths)
+        ]
+
+    def query(self, value, threshold=None):
+        """Returns [(distance, image_path)] of stored images within `threshold` bits, nearest first."""
+        threshold = self.threshold if threshold is None else threshold
+        candidates = set()
+        for buckets, substring, probe_masks in zip(self._buckets, self._substrings(value), self._probe_masks):
+            for mask in probe_masks:
+                bucket = buckets.get(substring ^ mask)
+                if bucket:
+                    candidates.update(bucket)
+
+        matches = []
+        for idx in candidates:
+            distance = hamming_distance(value, self._hashes[idx])
+            if distance <= threshold:
+                matches.append((distance, self._paths[idx]))
+        matches.sort()
+        return matches
+
+    def is_repost(self, value):
+        """True if a near-duplicate of the image is already indexed."""
+        return bool(self.query(value))
+
+    def cluster_of(self, image_path):
+        """Returns the cluster of an indexed image, looked up by media_key rather than the full path."""
+        return self._clusters_by_key.get(media_key(image_path))
+
+    def add(self, image_path, value):
+        """Indexes an image and returns its cluster id, reusing the cluster of its nearest duplicate."""
+        if image_path in self.entries:
+            return self.entries[image_path][1]
+
+        matches = self.query(value)
+        if matches:
+            cluster_id = self.entries[matches[0][1]][1]
+        else:
+            cluster_id = self._next_cluster_id
+            self._next_cluster_id += 1
+
+        idx = len(self._paths)
+        self._paths.append(image_path)
+        self._hashes.append(value)
+        for buckets, substring in zip(self._buckets, self._substrings(value)):
+            buckets[substring].append(idx)
+        self.entries[image_path] = (value, cluster_id)
+        self._clusters_by_key[media_key(image_path)] = cluster_id
+        return cluster_id
+
+    def save(self, path=HASH_INDEX_PATH):
+        """Writes the index to disk. Only hashes and clusters are stored; buckets are rebuilt on load."""
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            pickle.dump({
+                'threshold': self.threshold,
+                'chunks': self.chunks,
+                'entries': [(p, self.entries[p][0], self.entries[p][1]) for p in self._paths],
+            }, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path=HASH_INDEX_PATH, threshold=HAMMING_THRESHOLD):
+        """Loads an index saved by save(), or returns an empty one if there is none."""
+        if not os.path.exists(path):
+            return cls(threshold=threshold)
+
+        with open(path, 'rb') as f:
+            data = pickle.load(f)
+
+        index = cls(threshold=threshold, chunks=data['chunks'])
+        for image_path, value, cluster_id in data['entries']:
+            idx = len(index._paths)
+            index._paths.append(image_path)
+            index._hashes.append(value)
+            for buckets, substring in zip(index._buckets, index._substrings(value)):
+                buckets[substring].append(idx)
+            index.entries[image_path] = (value, cluster_id)
+            index._clusters_by_key[media_key(image_path)] = cluster_id
+            index._next_cluster_id = max(index._next_cluster_id, cluster_id + 1)
+        return index
+
+
+def update_index(index, media_root=MEDIA_ROOT):
+    """
+    Hashes every image under `media_root` that is not in the index yet and adds it.
+    Returns [(image_path, hash, cluster_id)] for the newly indexed images.
+    """
+    new_entries = []
+    for dirpath, _, filenames in os.walk(media_root):
+        for filename in sorted(filenames):
+            if not filename.lower().endswith(IMAGE_EXTENSIONS):
+                continue
+            image_path = os.path.join(dirpath, filename)
+            if image_path in index:
+                continue
+            try:
+                value = dhash(image_path)
+            except Exception as e:
+                print(f"Error hashing image {image_path}: {e}")
+                continue
+            cluster_id = index.add(image_path, value)
+            new_entries.append((image_path, value, cluster_id))
+    return new_entries
@@ -2,11 +2,14 @@ import os
 import asyncio
 import psycopg2
 from psycopg2 import sql
+from psycopg2.extras import execute_values
 from dotenv import load_dotenv
 from ultralytics import YOLO 
 import json 
 import time
 
+from image_hashing import ImageHashIndex, update_index, to_signed_64, image_size
+
 load_dotenv()
 
 # --- Database Configuration ---
@@ -23,6 +26,10 @@ print(f"DEBUG (YOLO): Attempting to connect to DB_HOST: {DB_HOST}")
 YOLO_MODEL_PATH = 'yolov8n.pt'
 model = YOLO(YOLO_MODEL_PATH)
 
+# SQL form of image_hashing.media_key and the dbt `media_key` macro: the image path
+# relative to telegram_media, so paths stored with different prefixes still match
+MEDIA_KEY_SQL = "COALESCE(SUBSTRING(REPLACE({column}, '\\', '/') FROM 'telegram_media/(.*)$'), REPLACE({column}, '\\', '/'))"
+
 
 def get_db_connection(retries=5, delay=3):
     """
@@ -73,6 +80,12 @@ async def ensure_raw_image_detections_table_exists():
             -- Add a unique constraint to prevent re-processing the same image for the same message
             UNIQUE (message_id, image_path)
         );
+        -- Pixel size the bboxes refer to, so they can be rescaled for resized reposts
+        ALTER TABLE raw_image_detections ADD COLUMN IF NOT EXISTS image_width INTEGER;
+        ALTER TABLE raw_image_detections ADD COLUMN IF NOT EXISTS image_height INTEGER;
+        -- Looked up by media key when reusing the detections of an image cluster
+        CREATE INDEX IF NOT EXISTS idx_raw_image_detections_media_key
+            ON raw_image_detections ((""" + MEDIA_KEY_SQL.format(column='image_path') + """));
         """
         cur.execute(create_table_query)
         conn.commit()
@@ -88,6 +101,110 @@ async def ensure_raw_image_detections_table_exists():
             conn.close()
 
 
+async def ensure_raw_image_hashes_table_exists():
+    """
+    Ensures the raw_image_hashes table exists in the database.
+    This table stores the perceptual hash and near-duplicate cluster of every media image.
+    """
+    conn = None
+    try:
+        conn = get_db_connection()
+        cur = conn.cursor()
+        create_table_query = """
+        CREATE TABLE IF NOT EXISTS raw_image_hashes (
+            image_path TEXT PRIMARY KEY,
+            dhash BIGINT NOT NULL, -- 64-bit difference hash, stored signed
+            cluster_id BIGINT NOT NULL, -- Images within the Hamming threshold share a cluster
+            hashed_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+        );
+        CREATE INDEX IF NOT EXISTS idx_raw_image_hashes_cluster_id
+            ON raw_image_hashes (cluster_id);
+        """
+        cur.execute(create_table_query)
+        conn.commit()
+        print("Ensured 'raw_image_hashes' table exists.")
+    except Exception as e:
+        print(f"Error ensuring 'raw_image_hashes' table exists: {e}")
+        if conn:
+            conn.rollback()
+        raise
+    finally:
+        if conn:
+            cur.close()
+            conn.close()
+
+
+async def insert_image_hashes(entries):
+    """
+    Bulk-inserts (image_path, hash, cluster_id) rows into the raw_image_hashes table.
+    Returns True if the rows were written.
+    """
+    conn = None
+    try:
+        conn = get_db_connection()
+        cur = conn.cursor()
+        execute_values(cur, """
+            INSERT INTO raw_image_hashes (image_path, dhash, cluster_id)
+            VALUES %s
+            ON CONFLICT (image_path) DO UPDATE SET
+                dhash = EXCLUDED.dhash,
+                cluster_id = EXCLUDED.cluster_id;
+        """, [(image_path, to_signed_64(value), cluster_id) for image_path, value, cluster_id in entries],
+            page_size=1000)
+        conn.commit()
+        return True
+    except Exception as e:
+        print(f"Error inserting image hashes: {e}")
+        if conn:
+            conn.rollback()
+        return False
+    finally:
+        if conn:
+            cur.close()
+            conn.close()
+
+
+async def get_cluster_detections(cluster_id):
+    """
+    Returns (detected_objects, image_width, image_height) already stored for an image
+    of the cluster, or None. Rows without an image size cannot be rescaled and are ignored.
+    """
+    conn = None
+    try:
+        conn = get_db_connection()
+        cur = conn.cursor()
+        cur.execute(f"""
+            SELECT rid.detected_objects, rid.image_width, rid.image_height
+            FROM raw_image_hashes rih
+            JOIN raw_image_detections rid
+                ON {MEDIA_KEY_SQL.format(column='rid.image_path')} = {MEDIA_KEY_SQL.format(column='rih.image_path')}
+            WHERE rih.cluster_id = %s
+                AND rid.image_width IS NOT NULL
+                AND rid.image_height IS NOT NULL
+            ORDER BY rid.detection_timestamp
+            LIMIT 1;
+        """, (cluster_id,))
+        return cur.fetchone()
+    except Exception as e:
+        print(f"Error retrieving detections for image cluster {cluster_id}: {e}")
+        return None
+    finally:
+        if conn:
+            cur.close()
+            conn.close()
+
+
+def rescale_detections(detections, from_size, to_size):
+    """Scales the pixel xyxy bboxes of detections made on an image of `from_size` to one of `to_size`."""
+    scale_x = to_size[0] / from_size[0]
+    scale_y = to_size[1] / from_size[1]
+    rescaled = []
+    for detection in detections:
+        x1, y1, x2, y2 = detection["bbox"]
+        rescaled.append({**detection, "bbox": [x1 * scale_x, y1 * scale_y, x2 * scale_x, y2 * scale_y]})
+    return rescaled
+
+
 async def get_messages_with_media_paths():
     """Retrieves messages with local media paths that haven't been processed."""
     conn = None
@@ -95,17 +212,38 @@ async def get_messages_with_media_paths():
         conn = get_db_connection()
         cur = conn.cursor()
 
+        # Videos are represented by the keyframes sampled by the scraper's media
+        # download workers, so YOLO never runs on a whole video file or a document.
         query = """
             SELECT
-                rtm.message_id,
-                rtm.local_media_path
-            FROM
-                raw_telegram_messages rtm
+                media.message_id,
+                media.image_path
+            FROM (
+                SELECT
+                    rtm.message_id,
+                    rtm.local_media_path AS image_path
+                FROM
+                    raw_telegram_messages rtm
+                LEFT JOIN
+                    raw_media_downloads rmd ON rtm.message_id = rmd.message_id
+                WHERE
+                    rtm.local_media_path IS NOT NULL
+                    AND (rmd.media_type IS NULL OR rmd.media_type = 'photo')
+                UNION
+                SELECT
+                    rmd.message_id,
+                    keyframe.path AS image_path
+                FROM
+                    raw_media_downloads rmd,
+                    jsonb_array_elements_text(rmd.keyframe_paths) AS keyframe(path)
+                WHERE
+                    rmd.status = 'downloaded'
+                    AND rmd.keyframe_paths IS NOT NULL
+            ) media
             LEFT JOIN
-                raw_image_detections rid ON rtm.message_id = rid.message_id AND rtm.local_media_path = rid.image_path
+                raw_image_detections rid ON media.message_id = rid.message_id AND media.image_path = rid.image_path
             WHERE
-                rtm.local_media_path IS NOT NULL
-                AND rid.id IS NULL; -- Only select if no corresponding detection record exists
+                rid.id IS NULL; -- Only select if no corresponding detection record exists
         """
         cur.execute(query)
         return cur.fetchall()
@@ -118,25 +256,29 @@ async def get_messages_with_media_paths():
             conn.close()
 
 
-async def insert_detection_results(message_id, image_path, detections):
-    """Inserts YOLO detection results into the raw_image_detections table."""
+async def insert_detection_results(message_id, image_path, detections, image_size):
+    """Inserts YOLO detection results and the (width, height) their bboxes refer to into the raw_image_detections table."""
     conn = None
     try:
         conn = get_db_connection()
         cur = conn.cursor()
         insert_query = sql.SQL("""
             INSERT INTO raw_image_detections (
-                message_id, image_path, detected_objects
+                message_id, image_path, detected_objects, image_width, image_height
             ) VALUES (
-                %s, %s, %s
+                %s, %s, %s, %s, %s
             ) ON CONFLICT (message_id, image_path) DO UPDATE SET
                 detected_objects = EXCLUDED.detected_objects,
+                image_width = EXCLUDED.image_width,
+                image_height = EXCLUDED.image_height,
                 detection_timestamp = NOW();
         """)
         cur.execute(insert_query, (
             message_id,
             image_path,
-            json.dumps(detections) 
+            json.dumps(detections),
+            image_size[0],
+            image_size[1]
         ))
         conn.commit()
         print(f"Inserted/Updated YOLO detections for message {message_id} - {image_path}")
@@ -156,6 +298,19 @@ async def process_images_with_yolo():
     Main function to fetch images, run YOLO, and store results.
     """
     await ensure_raw_image_detections_table_exists()
+    await ensure_raw_image_hashes_table_exists()
+
+    # Hash any media added since the last run so reposts can reuse earlier detections
+    hash_index = ImageHashIndex.load()
+    new_hashes = update_index(hash_index)
+    if new_hashes:
+        # The index is only saved once the hashes are in the database; otherwise the
+        # images would count as indexed on disk and never reach raw_image_hashes.
+        if await insert_image_hashes(new_hashes):
+            hash_index.save()
+            print(f"Indexed {len(new_hashes)} new image(s); {len(hash_index)} image(s) in the hash index.")
+        else:
+            print(f"Hash index not saved; {len(new_hashes)} new image(s) will be hashed again on the next run.")
 
     messages_to_process = await get_messages_with_media_paths()
 
@@ -170,13 +325,33 @@ async def process_images_with_yolo():
             print(f"Warning: Image file not found at {image_path} for message {message_id}. Skipping.")
             continue
 
+        cluster_id = hash_index.cluster_of(image_path)
+        if cluster_id is not None:
+            cluster_detections = await get_cluster_detections(cluster_id)
+            if cluster_detections is not None:
+                detections, width, height = cluster_detections
+                try:
+                    size = image_size(image_path)
+                except Exception as e:
+                    print(f"Error reading size of image {image_path}: {e}")
+                else:
+                    print(f"Reusing detections of image cluster {cluster_id} for repost {image_path}")
+                    # A repost may be a resized copy; bboxes are pixel coordinates of the original
+                    await insert_detection_results(
+                        message_id, image_path, rescale_detections(detections, (width, height), size), size
+                    )
+                    continue
+
         print(f"Processing image: {image_path} for message ID: {message_id}")
         try:
             # Run YOLO inference
             results = model(image_path) 
 
             detected_objects_list = []
+            orig_size = None
             for r in results:
+                orig_height, orig_width = r.orig_shape
+                orig_size = (orig_width, orig_height)
 
                 for box in r.boxes:
                     class_id = int(box.cls[0])
@@ -190,7 +365,9 @@ async def process_images_with_yolo():
                         "bbox": bbox
                     })
 
-            await insert_detection_results(message_id, image_path, detected_objects_list)
+            await insert_detection_results(
+                message_id, image_path, detected_objects_list, orig_size or image_size(image_path)
+            )
 
         except Exception as e:
             print(f"Error processing image {image_path} for message {message_id}: {e}")
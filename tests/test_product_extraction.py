@@ -0,0 +1,105 @@
+"""
+Unit tests for the price and product matching of the product extraction stage.
+Run against the curated dictionary shipped next to the module; no database is needed.
+"""
+
+from decimal import Decimal
+import pytest
+
+pytest.importorskip("ahocorasick")
+
+from src.enrichment import product_extraction as pe
+
+
+@pytest.fixture(scope="module")
+def automaton():
+    return pe.build_automaton(pe.load_product_dictionary())
+
+
+def prices_of(text):
+    return [amount for _, amount in pe.extract_prices(text)]
+
+
+def products_and_prices(automaton, text):
+    return [(m[1], m[5]) for m in pe.extract_mentions(automaton, 1, text)]
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("ETB 1,200", [Decimal("1200")]),
+    ("1200 birr", [Decimal("1200")]),
+    ("250.50 Br.", [Decimal("250.50")]),
+    ("300ብር", [Decimal("300")]),
+    ("Price: 450", [Decimal("450")]),
+    ("ዋጋ 90", [Decimal("90")]),
+    ("ዋጋ፦ 90", [Decimal("90")]),
+    ("ዋጋ፡ 90", [Decimal("90")]),
+    ("Price፣ 90", [Decimal("90")]),
+    ("birr 0", []),
+])
+def test_extract_prices(text, expected):
+    assert prices_of(text) == expected
+
+
+@pytest.mark.parametrize("text", [
+    "Lotion for abr 300",
+    "cobra 300",
+    "zebra 300 units",
+    "300 brand new",
+    "300 etbx",
+    "60 ብርቱካን",
+])
+def test_extract_prices_needs_whole_currency_word(text):
+    assert prices_of(text) == []
+
+
+def test_extract_mentions_attaches_nearest_following_price(automaton):
+    assert products_and_prices(automaton, "Panadol 500mg now 120 birr") == [("Paracetamol", Decimal("120"))]
+
+
+def test_extract_mentions_price_stops_at_next_product(automaton):
+    assert products_and_prices(automaton, "zinc and niacinamide serum 500 br") == [
+        ("Zinc", None),
+        ("Niacinamide Serum", Decimal("500")),
+    ]
+
+
+def test_extract_mentions_each_product_gets_its_own_price(automaton):
+    assert products_and_prices(automaton, "Amoxil 150 birr, Flagyl 80 birr") == [
+        ("Amoxicillin", Decimal("150")),
+        ("Metronidazole", Decimal("80")),
+    ]
+
+
+def test_extract_mentions_prefers_longest_alias(automaton):
+    mentions = pe.extract_mentions(automaton, 1, "New digital thermometer in stock")
+    assert [(m[1], m[3]) for m in mentions] == [("Thermometer", "digital thermometer")]
+
+
+def test_extract_mentions_requires_word_boundaries(automaton):
+    assert products_and_prices(automaton, "zincite and cipromax") == []
+
+
+def test_extract_mentions_ignores_price_beyond_max_distance(automaton):
+    text = "Insulin " + "x" * pe.PRICE_MAX_DISTANCE + " 900 birr"
+    assert products_and_prices(automaton, text) == [("Insulin", None)]
+
+
+def test_extract_mentions_amharic(automaton):
+    assert products_and_prices(automaton, "ፓናዶል ዋጋ 60") == [("Paracetamol", Decimal("60"))]
+
+
+def test_extract_mentions_ethiopic_label_separator(automaton):
+    assert products_and_prices(automaton, "Panadol ዋጋ፦ 60") == [("Paracetamol", Decimal("60"))]
+
+
+@pytest.mark.parametrize("text", [
+    "በፓናዶል 60 ብር",     # "with Panadol"
+    "ፓናዶልን 60 ብር",     # object suffix
+    "የፓናዶልዎች 60 ብር",   # prefix and plural suffix
+])
+def test_extract_mentions_amharic_affixes(automaton, text):
+    assert products_and_prices(automaton, text) == [("Paracetamol", Decimal("60"))]
+
+
+def test_extract_mentions_amharic_rejects_unknown_affix(automaton):
+    assert products_and_prices(automaton, "ሳፓናዶል 60 ብር") == []